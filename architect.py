@@ -0,0 +1,514 @@
+import os
+import json
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+import requests
+
+from level_cache import LevelCache
+from level_pack import load_packs
+from model_stats import ModelStats
+from level_schema import LEVEL_KEYS, loads_lenient, repair_field, repair_level
+
+# Level generation through Ollama: prompt, streaming parse, repair, racing
+# and model warm-up. Nothing here needs a display, so command-line tools
+# (see level_pack.py) can generate levels without starting the game.
+
+DIFFICULTY_SETTINGS = {
+    "CHILL": {"bpm": "80-100", "speed": "4-6", "desc": "Relaxed and atmospheric"},
+    "FLOW": {"bpm": "100-130", "speed": "6-8", "desc": "Steady and rhythmic"},
+    "NEURAL": {"bpm": "130-160", "speed": "8-10", "desc": "Fast and intense"},
+    "OVERLOAD": {"bpm": "160-200", "speed": "10-14", "desc": "Extreme speed and complexity"}
+}
+RACE_WIDTH = 3 # Models raced against each other, the selected one included
+REPAIR_BUDGET = 2 # Follow-up requests for fields local repair can't produce
+KEEP_ALIVE = "60m" # How long Ollama keeps a model we use loaded; roughly a play session
+FIELD_HINTS = {
+    "name": "the world's name, 2-4 words",
+    "introtext": "a cinematic introduction to this specific world (2-3 sentences)",
+    "flavor_text": "a short atmospheric description",
+}
+
+
+class IncrementalLevelParser:
+    # Scans the streamed completion char by char and hands out top-level
+    # "key": value pairs as soon as each one is closed, so the caller can use
+    # name/palette/bpm before the rest of the object has arrived.
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.segment_start = None
+        self.complete = False
+        self.fields = {}
+
+    def feed(self, text):
+        self.buffer += text
+        new_fields = []
+        while self.pos < len(self.buffer) and not self.complete:
+            ch = self.buffer[self.pos]
+            if self.segment_start is None and ch != '{':
+                pass # Skip any chatter before the object starts
+            elif self.in_string:
+                if self.escape: self.escape = False
+                elif ch == '\\': self.escape = True
+                elif ch == '"': self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in '{[':
+                self.depth += 1
+                if self.depth == 1: self.segment_start = self.pos + 1
+            elif ch in '}]':
+                if self.depth == 1: self._close_segment(new_fields)
+                self.depth -= 1
+                if self.depth == 0 and self.segment_start is not None: self.complete = True
+            elif ch == ',' and self.depth == 1:
+                self._close_segment(new_fields)
+                self.segment_start = self.pos + 1
+            self.pos += 1
+        return new_fields
+
+    def _close_segment(self, new_fields):
+        segment = self.buffer[self.segment_start:self.pos].strip()
+        if not segment: return
+        try:
+            pair = loads_lenient("{" + segment + "}")
+        except ValueError:
+            return
+        for key, value in pair.items():
+            self.fields[key] = value
+            new_fields.append((key, value))
+
+    def pending_text(self):
+        # (key, text so far) while a top-level string value is still streaming
+        if not (self.in_string and self.depth == 1 and self.segment_start is not None): return None
+        segment = self.buffer[self.segment_start:self.pos]
+        key_part, sep, value_part = segment.partition(':')
+        if not sep: return None
+        value_part = value_part.lstrip()[1:]
+        if value_part.endswith('\\'): value_part = value_part[:-1]
+        try:
+            return json.loads(key_part.strip()), json.loads('"' + value_part + '"')
+        except ValueError:
+            return None
+
+    def text(self):
+        start = self.buffer.find('{')
+        return self.buffer[start:self.pos] if start != -1 else self.buffer
+
+class GenerationJob:
+    # Handle for a level generation running on a daemon thread, so a hung
+    # Ollama request never keeps the window (or interpreter exit) waiting.
+    def __init__(self, fn, *args):
+        self.future = Future()
+        self.cancel_event = threading.Event()
+        self.partial = {}
+        self.parser = None
+        self.source = None # See LevelArchitect.generate_level's on_result
+        self.complete = False
+        self.started_at = time.perf_counter()
+        self.thread = threading.Thread(target=self._work, args=(fn, args), daemon=True)
+        self.thread.start()
+
+    def _work(self, fn, args):
+        try:
+            result = fn(*args, cancel_event=self.cancel_event, on_field=self._on_field, on_parser=self._on_parser,
+                        on_result=self._on_result)
+        except Exception as e:
+            self.future.set_exception(e)
+            return
+        if not self.cancel_event.is_set():
+            self.future.set_result(result)
+
+    def _on_field(self, key, value):
+        self.partial[key] = value
+
+    def _on_parser(self, parser):
+        self.parser = parser
+
+    def _on_result(self, source, complete):
+        self.source, self.complete = source, complete
+
+    def has_fields(self, *keys):
+        return all(k in self.partial for k in keys)
+
+    def pending_text(self, key):
+        pending = self.parser.pending_text() if self.parser else None
+        return pending[1] if pending and pending[0] == key else None
+
+    def done(self):
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+class LevelArchitect:
+    def __init__(self, host=None):
+        # OLLAMA_HOST is Ollama's own setting for where the server listens
+        host = host or os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+        self.host = host if "://" in host else "http://" + host
+        self.url = self.host + "/api/generate"
+        self.available_models = []
+        self.model = "mistral"
+        self.online = False
+        self.stream = True
+        self.race = False # Opt-in: send each prompt to several models, keep the first valid level
+        self.cache = LevelCache()
+        self.packs = load_packs() # Pre-generated levels (level_pack.py), used as-is and when offline
+        self.model_stats = ModelStats()
+        self.model_state = {} # model -> "LOADING", "READY" or "FAILED"; absent = not loaded
+        self.kept_alive = set() # Models we asked Ollama to keep loaded (and so may unload)
+        self.state_lock = threading.Lock()
+
+        # One keep-alive connection pool for all Ollama traffic
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=8)
+        self.session.mount("http://", adapter)
+
+        # Probe /api/tags once, off the main thread, so the first frame isn't held up
+        self.probed = threading.Event()
+        threading.Thread(target=self.refresh_available_models, daemon=True).start()
+
+    def refresh_available_models(self):
+        try:
+            response = self.session.get(self.host + "/api/tags", timeout=2)
+            self.online = True
+            if response.status_code == 200:
+                data = response.json()
+                self.available_models = [m['name'] for m in data.get('models', [])]
+                # Default to the model with the best observed p50 latency
+                fastest = self.model_stats.fastest(self.available_models)
+                if fastest:
+                    self.model = fastest
+                elif self.available_models and self.model not in self.available_models:
+                    self.model = self.available_models[0]
+            self._read_loaded_models()
+        except requests.RequestException:
+            self.online = False
+        except:
+            self.available_models = ["mistral", "gemma3"] # Fallbacks
+        finally:
+            self.probed.set()
+        if self.online: self.sync_models()
+
+    def _read_loaded_models(self):
+        # Models Ollama already has in memory are warm. They are only unloaded
+        # later if we asked for them to be kept alive ourselves.
+        try:
+            response = self.session.get(self.host + "/api/ps", timeout=2)
+            if response.status_code == 200:
+                with self.state_lock:
+                    for m in response.json().get('models', []):
+                        self.model_state[m['name']] = "READY"
+        except (requests.RequestException, ValueError, KeyError):
+            pass
+
+    def select_model(self, model):
+        self.model = model
+        if self.online: self.sync_models() # Offline, warm-ups would only fail and mark models FAILED
+
+    def sync_models(self):
+        # Keep exactly the models a generation would use loaded: warm the
+        # selected model (and the other racers), unload what was cycled away from
+        wanted = self.race_models()
+        with self.state_lock:
+            to_warm = [m for m in wanted if m not in self.kept_alive]
+            to_unload = [m for m in self.kept_alive if m not in wanted]
+            for m in to_warm:
+                self.kept_alive.add(m)
+                if self.model_state.get(m) != "READY": self.model_state[m] = "LOADING"
+            for m in to_unload:
+                self.kept_alive.discard(m)
+                self.model_state.pop(m, None)
+        for m in to_warm:
+            threading.Thread(target=self._set_keep_alive, args=(m, KEEP_ALIVE), daemon=True).start()
+        for m in to_unload:
+            threading.Thread(target=self._set_keep_alive, args=(m, 0), daemon=True).start()
+
+    def _set_keep_alive(self, model, keep_alive):
+        # An empty prompt makes Ollama load (or, with keep_alive 0, unload) the
+        # model without generating anything. Skipped if the player has cycled
+        # back or away again since this was queued.
+        with self.state_lock:
+            if (model in self.kept_alive) != bool(keep_alive): return
+        try:
+            response = self.session.post(self.url, json={"model": model, "prompt": "", "stream": False, "keep_alive": keep_alive}, timeout=(3, 300))
+            response.raise_for_status()
+            state = "READY"
+        except requests.RequestException as e:
+            print(f"Model {'warm-up' if keep_alive else 'unload'} failed for {model}: {e}")
+            state = "FAILED"
+        if not keep_alive: return
+        with self.state_lock:
+            # Unless it was cycled away from while loading
+            if model not in self.kept_alive: return
+            self.model_state[model] = state
+            if state == "FAILED": self.kept_alive.discard(model) # Retried on the next sync
+
+    def model_status(self, model):
+        with self.state_lock:
+            return self.model_state.get(model, "COLD")
+
+    def generate_level_async(self, theme, mode, difficulty, use_cache=True):
+        return GenerationJob(self.generate_level, theme, mode, difficulty, use_cache)
+
+    def generate_level(self, theme, mode, difficulty, use_cache=True, cancel_event=None, on_field=None, on_parser=None, on_result=None, store=True):
+        # use_cache=False skips the cache and pack lookup ("regenerate anyway") but still
+        # stores the fresh level; store=False leaves the cache alone (level_pack.py bakes).
+        # on_result(source, complete) says where the level came from ("cache", "pack", "model" or
+        # "fallback") and whether it is a finished level for this theme rather than a stand-in.
+        level, source, complete = self._generate_level(theme, mode, difficulty, use_cache, store, cancel_event, on_field, on_parser)
+        if on_result: on_result(source, complete)
+        return level
+
+    def _generate_level(self, theme, mode, difficulty, use_cache, store, cancel_event, on_field, on_parser):
+        cache_key = self.cache.make_key(theme, mode, difficulty, self.model)
+        if use_cache:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                print(f"Universe restored from cache: {cached.get('name', 'Untitled')}")
+                if on_field:
+                    for key, value in cached.items(): on_field(key, value)
+                return cached, "cache", True
+            for pack in self.packs:
+                packed = pack.get(theme, mode, difficulty)
+                if packed is not None:
+                    print(f"Universe loaded from pack: {packed.get('name', 'Untitled')}")
+                    if on_field:
+                        for key, value in packed.items(): on_field(key, value)
+                    return packed, "pack", True
+
+        ds = DIFFICULTY_SETTINGS.get(difficulty, DIFFICULTY_SETTINGS["FLOW"])
+
+        default_level = {
+            "palette": {"bg": [20, 20, 30], "lane": [50, 50, 50], "note": [0, 255, 255], "hit": [255, 255, 255]},
+            "speed": 8,
+            "bpm": 120,
+            "name": "Offline Protocol",
+            "introtext": "CRITICAL ERROR: Connection to the main neural network has been severed. Defaulting to local rhythm protocols.",
+            "flavor_text": "Local simulation active."
+        }
+
+        self.probed.wait(3)
+        if not self.online:
+            # Kiosk machines run on packs alone: any level of this mode beats the stock one
+            for pack in self.packs:
+                packed = pack.pick(theme, mode, difficulty)
+                if packed is not None:
+                    if on_field:
+                        for key, value in packed.items(): on_field(key, value)
+                    return packed, "pack", False # Another theme's level
+            return default_level, "fallback", False
+
+        mode_desc = {
+            "2K": "2 vertical lanes (Left, Right)",
+            "4K": "4 vertical lanes (D, F, J, K)",
+            "OSU": "Random circle positions on screen (x: 0-800, y: 0-600)"
+        }
+
+        prompt = f"""
+        You are a music engine. Create a JSON config for a rhythm game level.
+        Theme: '{theme}'
+        Game Mode: '{mode}' ({mode_desc.get(mode)})
+        Difficulty: '{difficulty}' ({ds['desc']})
+
+        Rules:
+        1. 'speed': integer {ds['speed']}. (For OSU, this is circle shrink speed, do not make too much notes appear at a time in osu mode).
+        2. 'bpm': integer {ds['bpm']}.
+        3. 'palette': RGB colors for bg, lane, note, hit.
+        4. 'introtext': A cinematic introduction to this specific world (2-3 sentences).
+        5. 'flavor_text': A short atmospheric description.
+
+        Output ONLY raw JSON:
+        {{
+            "palette": {{ "bg": [r,g,b], "lane": [r,g,b], "note": [r,g,b], "hit": [r,g,b] }},
+            "speed": 8,
+            "bpm": 128,
+            "name": "World Name",
+            "introtext": "Description...",
+            "flavor_text": "Flavor..."
+        }}
+        """
+        try:
+            print(f"Requesting '{theme}' universe from Ollama ({self.model})...")
+            
+            payload = {
+                "model": self.model,
+                "prompt": prompt,
+                "stream": self.stream,
+                "format": "json",
+                "keep_alive": KEEP_ALIVE
+            }
+
+            racers = self.race_models()
+            if len(racers) > 1:
+                winner, level_data = self._race(payload, racers, ds, cancel_event)
+                if level_data is None:
+                    if cancel_event is not None and cancel_event.is_set():
+                        print(f"Request for '{theme}' aborted.")
+                    else:
+                        print(f"Ollama generation failed: no valid level from {', '.join(racers)}")
+                    return default_level, "fallback", False
+                if on_field:
+                    for key, value in level_data.items(): on_field(key, value)
+                if store: self.cache.put(cache_key, level_data) # Under the selected model, like any other level
+                print(f"Universe synchronized: {level_data.get('name', 'Untitled')} (raced, {winner} won)")
+                return level_data, "model", True
+
+            started = time.perf_counter()
+            if self.stream:
+                level_data = self._generate_streaming(payload, cancel_event, on_field, on_parser)
+                if level_data is None:
+                    print(f"Request for '{theme}' aborted.")
+                    return default_level, "fallback", False
+            else:
+                response = self.session.post(self.url, json=payload, timeout=(3, 60))
+                response.raise_for_status()
+                if cancel_event is not None and cancel_event.is_set():
+                    print(f"Request for '{theme}' aborted.")
+                    return default_level, "fallback", False
+                
+                result = response.json()
+                raw_text = result.get("response", "")
+                
+                level_data = loads_lenient(raw_text)
+
+            # Fix what can be fixed locally; only text the model never (validly)
+            # produced costs another, much smaller, request
+            level_data, missing = repair_level(level_data, ds)
+            if missing:
+                self.model_stats.record_failure(self.model)
+                print(f"Re-requesting {', '.join(missing)} for '{theme}'...")
+                level_data, missing = self._request_fields(theme, level_data, missing, cancel_event)
+            else:
+                self.model_stats.record(self.model, time.perf_counter() - started)
+            if cancel_event is not None and cancel_event.is_set():
+                print(f"Request for '{theme}' aborted.")
+                return default_level, "fallback", False
+            if missing:
+                # Out of budget: stock text keeps the level playable, but it isn't cached
+                for key in missing: level_data[key] = default_level[key]
+            elif store:
+                self.cache.put(cache_key, level_data)
+            if on_field:
+                for key in LEVEL_KEYS: on_field(key, level_data[key])
+            print(f"Universe synchronized: {level_data.get('name', 'Untitled')}")
+            return level_data, "model", not missing
+        except Exception as e:
+            print(f"Ollama generation failed: {e}")
+            self.model_stats.record_failure(self.model)
+            return default_level, "fallback", False
+
+    def race_models(self):
+        # The selected model first, then the other local models, up to RACE_WIDTH
+        if not self.race: return [self.model]
+        return ([self.model] + [m for m in self.available_models if m != self.model])[:RACE_WIDTH]
+
+    def _request_fields(self, theme, level_data, missing, cancel_event):
+        # Ask only for the given text fields, at most REPAIR_BUDGET times.
+        # Returns (level_data, keys still missing).
+        missing = list(missing)
+        for _ in range(REPAIR_BUDGET):
+            if cancel_event is not None and cancel_event.is_set(): break
+            wanted = ", ".join(f"'{key}': {FIELD_HINTS[key]}" for key in missing)
+            prompt = f"""
+        You are a music engine writing text for a rhythm game level.
+        Theme: '{theme}'
+        World name: '{level_data.get('name', 'not chosen yet')}'
+
+        Output ONLY raw JSON with exactly these string fields: {wanted}.
+        """
+            try:
+                response = self.session.post(self.url, json={"model": self.model, "prompt": prompt, "stream": False, "format": "json", "keep_alive": KEEP_ALIVE}, timeout=(3, 30))
+                response.raise_for_status()
+                fields = loads_lenient(response.json().get("response", ""))
+            except (requests.RequestException, ValueError) as e:
+                print(f"Field re-request failed: {e}")
+                continue
+            if not isinstance(fields, dict): continue
+            for key in list(missing):
+                value = repair_field(key, fields.get(key))
+                if value is not None:
+                    level_data[key] = value
+                    missing.remove(key)
+            if not missing: break
+        return level_data, missing
+
+    def _race(self, payload, models, difficulty, cancel_event):
+        # Stream the same prompt from every model at once. The first level that
+        # needs no re-request after local repair wins; closing the other
+        # streams makes Ollama stop them.
+        stop = threading.Event()
+        results = queue.Queue()
+
+        def racer(model):
+            started = time.perf_counter()
+            try:
+                level = self._generate_streaming({**payload, "model": model, "stream": True}, stop, None, None)
+                level, missing = repair_level(level, difficulty) if level is not None else (None, LEVEL_KEYS)
+            except Exception:
+                level, missing = None, LEVEL_KEYS
+            if not missing:
+                results.put((model, level, time.perf_counter() - started))
+            else:
+                if not stop.is_set(): self.model_stats.record_failure(model) # Losers cut off mid-stream don't count
+                results.put((model, None, None))
+
+        for model in models:
+            threading.Thread(target=racer, args=(model,), daemon=True).start()
+        pending = len(models)
+        try:
+            while pending:
+                if cancel_event is not None and cancel_event.is_set(): return None, None
+                try:
+                    model, level, latency = results.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                pending -= 1
+                if level is not None:
+                    self.model_stats.record(model, latency, won=True)
+                    return model, level
+            return None, None
+        finally:
+            stop.set()
+
+    def _generate_streaming(self, payload, cancel_event, on_field, on_parser):
+        # The streamed level as parsed (unrepaired), or None if cancelled
+        parser = IncrementalLevelParser()
+        if on_parser: on_parser(parser)
+        response = self.session.post(self.url, json=payload, stream=True, timeout=(3, 60))
+        try:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if cancel_event is not None and cancel_event.is_set():
+                    return None
+                if not line: continue
+                chunk = json.loads(line)
+                for key, value in parser.feed(chunk.get("response", "")):
+                    # Only repaired values reach the UI, so a bad color can't crash the intro
+                    value = repair_field(key, value)
+                    if on_field and value is not None: on_field(key, value)
+                # Stop reading as soon as the level object is closed
+                if parser.complete or chunk.get("done"): break
+        finally:
+            response.close()
+
+        if parser.complete:
+            try:
+                return loads_lenient(parser.text())
+            except ValueError:
+                pass
+        if not parser.fields:
+            raise ValueError("no usable fields in streamed response")
+        # Keep whatever fields did arrive intact; repair fills in the rest
+        return dict(parser.fields)
@@ -0,0 +1,321 @@
+import os
+import sys
+import time
+import wave
+import hashlib
+import argparse
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+
+from storage import data_path, atomic_write_json, read_json
+
+# Offline tempo, beat grid and onset estimation for custom music, based on
+# spectral flux: the summed rise in log magnitude between STFT frames. Flux
+# is computed in chunks on a process pool; results are cached by the file's
+# content hash, so analyzing the same track again is just a JSON read.
+
+ANALYSIS_VERSION = 2 # 2: beat and onset times moved to the flux peak
+AUDIO_EXTENSIONS = (".wav", ".ogg", ".mp3", ".flac")
+TARGET_RATE = 22050 # Input is decimated to roughly this before the STFT
+N_FFT = 2048
+HOP = 512
+CHUNK_SECONDS = 30
+MIN_BPM, MAX_BPM = 70, 190
+WINDOW = np.hanning(N_FFT).astype(np.float32)
+# Flux at frame j is the rise from frame j-1. The window's tapered end hides
+# an onset from frame j-1, so the peak comes when the onset sits about one
+# hop in from the end of frame j.
+ONSET_LAG = N_FFT - HOP
+CHECK_TOLERANCE = 0.005 # Seconds a click-track beat may be off in --check
+
+def is_audio_file(path):
+    return path.lower().endswith(AUDIO_EXTENSIONS) and os.path.isfile(path)
+
+def file_digest(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def read_wav(path):
+    # PCM WAV through the standard library, mixed down to mono float32
+    with wave.open(path, "rb") as w:
+        channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+        raw = w.readframes(w.getnframes())
+    if width == 1:
+        data = (np.frombuffer(raw, np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        data = np.frombuffer(raw, "<i2").astype(np.float32) / 32768
+    elif width == 3:
+        b = np.frombuffer(raw, np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        data = ints.astype(np.float32) / 8388608
+    elif width == 4:
+        data = np.frombuffer(raw, "<i4").astype(np.float32) / 2147483648
+    else:
+        raise ValueError(f"unsupported sample width: {width}")
+    return data.reshape(-1, channels).mean(axis=1), rate
+
+def read_with_pygame(path):
+    # Anything else goes through SDL_mixer's decoders
+    import pygame
+    if not pygame.mixer.get_init():
+        pygame.mixer.init()
+    rate = pygame.mixer.get_init()[0]
+    samples = pygame.sndarray.array(pygame.mixer.Sound(path))
+    if samples.dtype.kind == "u":
+        info = np.iinfo(samples.dtype)
+        samples = (samples.astype(np.float32) - (info.max + 1) / 2) / ((info.max + 1) / 2)
+    elif samples.dtype.kind == "i":
+        samples = samples.astype(np.float32) / (np.iinfo(samples.dtype).max + 1)
+    samples = samples.astype(np.float32)
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    return samples, rate
+
+def load_audio(path):
+    if path.lower().endswith(".wav"):
+        try:
+            return read_wav(path)
+        except (wave.Error, ValueError):
+            pass # e.g. float or compressed WAV
+    return read_with_pygame(path)
+
+def decimate(samples, rate):
+    # Block-average down to about TARGET_RATE; crude, but only onsets matter
+    factor = max(1, int(rate // TARGET_RATE))
+    if factor == 1:
+        return samples, rate
+    n = len(samples) // factor * factor
+    return samples[:n].reshape(-1, factor).mean(axis=1), rate / factor
+
+def frame_count(n_samples):
+    return 0 if n_samples < N_FFT else 1 + (n_samples - N_FFT) // HOP
+
+def spectral_flux(samples):
+    # Flux for frames 1..n-1 of this slice (frame 0 only serves as the reference)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, N_FFT)[::HOP]
+    if len(frames) < 2:
+        return np.zeros(0, dtype=np.float32)
+    log_mag = np.log1p(100 * np.abs(np.fft.rfft(frames * WINDOW, axis=1))).astype(np.float32)
+    return np.maximum(np.diff(log_mag, axis=0), 0).sum(axis=1)
+
+def flux_chunks(n_frames, chunk_frames):
+    # (first frame, end frame, sample slice) per chunk; each slice starts one
+    # frame early so the chunk's first difference has its reference frame
+    for a in range(0, n_frames, chunk_frames):
+        b = min(n_frames, a + chunk_frames)
+        s = max(a - 1, 0)
+        yield a, b, slice(s * HOP, (b - 1) * HOP + N_FFT)
+
+def onset_envelope(samples, rate, workers=None, progress=None):
+    n_frames = frame_count(len(samples))
+    chunk_frames = max(2, int(CHUNK_SECONDS * rate / HOP))
+    chunks = list(flux_chunks(n_frames, chunk_frames))
+    parts = []
+    if len(chunks) <= 1 or workers == 1:
+        for i, (a, b, sl) in enumerate(chunks):
+            parts.append(spectral_flux(samples[sl]))
+            if progress: progress((i + 1) / len(chunks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers or min(4, os.cpu_count() or 1)) as pool:
+            futures = [pool.submit(spectral_flux, samples[sl]) for a, b, sl in chunks]
+            for i, future in enumerate(futures):
+                parts.append(future.result())
+                if progress: progress((i + 1) / len(chunks))
+    flux = np.concatenate([np.zeros(1, dtype=np.float32)] + parts) if parts else np.zeros(0, dtype=np.float32)
+
+    # Remove the slowly varying loudness, keep the rises
+    frame_rate = rate / HOP
+    width = max(1, int(frame_rate * 0.5))
+    local_mean = np.convolve(flux, np.ones(width) / width, mode="same")
+    env = np.maximum(flux - local_mean, 0)
+    peak = env.max() if len(env) else 0
+    return env / peak if peak > 0 else env
+
+def estimate_tempo(env, frame_rate):
+    # Autocorrelation over the allowed BPM range, weighted towards ~120 BPM to
+    # avoid octave errors; returns the beat period in frames
+    n = len(env)
+    centered = env - env.mean()
+    spectrum = np.fft.rfft(centered, 2 * n)
+    ac = np.fft.irfft(spectrum * np.conj(spectrum))[:n]
+    lo = max(1, int(60 * frame_rate / MAX_BPM))
+    hi = min(n - 2, int(60 * frame_rate / MIN_BPM) + 1)
+    if hi <= lo:
+        return 60 * frame_rate / 120
+    lags = np.arange(lo, hi + 1)
+    weight = np.exp(-0.5 * np.log2(60 * frame_rate / lags / 120) ** 2)
+    best = lo + int(np.argmax(ac[lo:hi + 1] * weight))
+    # Parabolic interpolation for a sub-frame period
+    y0, y1, y2 = ac[best - 1], ac[best], ac[best + 1]
+    denom = y0 - 2 * y1 + y2
+    return best + (0.5 * (y0 - y2) / denom if denom else 0.0)
+
+def beat_grid(env, period):
+    # Best (period, phase) for a fixed grid within 2% of the autocorrelation
+    # estimate, then a least-squares fit of grid index to the nearby envelope
+    # peaks so the grid doesn't drift over a long track
+    n = len(env)
+    k = np.arange(int(n / period) + 1)
+    phases = np.arange(int(period))
+    best_score, grid = -1, None
+    for p in period * np.linspace(0.98, 1.02, 161):
+        positions = np.rint(phases[:, None] + k[None, :] * p).astype(int)
+        scores = np.where(positions < n, env[np.minimum(positions, n - 1)], 0).sum(axis=1)
+        i = int(np.argmax(scores))
+        if scores[i] > best_score:
+            best_score, period = scores[i], p
+            grid = phases[i] + k * p
+    grid = grid[grid < n]
+
+    radius = max(1, int(period / 4))
+    snapped, index = [], []
+    for i, g in enumerate(grid):
+        a, b = max(0, int(g) - radius), min(n, int(g) + radius + 1)
+        j = a + int(np.argmax(env[a:b]))
+        if env[j] > 0.1:
+            snapped.append(j)
+            index.append(i)
+    snapped = refine_peaks(env, snapped).tolist()
+    if len(snapped) >= 8:
+        period, phase = np.polyfit(index, snapped, 1)
+        grid = phase + np.arange(len(grid) + 1) * period
+        grid = grid[(grid >= 0) & (grid < n)]
+    return grid, period
+
+def pick_onsets(env, frame_rate, threshold=0.1):
+    # Local maxima over +-50 ms that stand out from the surrounding 200 ms
+    if len(env) < 3:
+        return np.zeros(0, dtype=int)
+    w = max(1, int(frame_rate * 0.05))
+    padded = np.pad(env, w, mode="constant")
+    local_max = np.lib.stride_tricks.sliding_window_view(padded, 2 * w + 1).max(axis=1)
+    m = max(1, int(frame_rate * 0.2))
+    local_mean = np.convolve(env, np.ones(m) / m, mode="same")
+    return refine_peaks(env, np.flatnonzero((env == local_max) & (env > local_mean + threshold)))
+
+def refine_peaks(env, frames):
+    # Sub-frame peak positions by parabolic interpolation; a frame is 23 ms
+    frames = np.asarray(frames, dtype=int)
+    inner = (frames > 0) & (frames < len(env) - 1)
+    refined = frames.astype(np.float64)
+    p = frames[inner]
+    y0, y1, y2 = env[p - 1], env[p], env[p + 1]
+    denom = y0 - 2 * y1 + y2
+    safe = np.where(denom != 0, denom, 1)
+    refined[inner] += np.where(denom != 0, 0.5 * (y0 - y2) / safe, 0.0)
+    return refined
+
+def frames_to_seconds(frames, rate):
+    return (np.asarray(frames) * HOP + ONSET_LAG) / rate
+
+def click_track(bpm=120, first=0.5, seconds=20, rate=TARGET_RATE):
+    # Decaying 1 kHz clicks on a quiet noise floor; (samples, click times)
+    rng = np.random.default_rng(0)
+    samples = rng.normal(0, 0.001, int(seconds * rate)).astype(np.float32)
+    k = np.arange(int(0.02 * rate))
+    click = (np.sin(2 * np.pi * 1000 * k / rate) * np.exp(-k / (0.003 * rate))).astype(np.float32)
+    times = np.arange(first, seconds - 0.1, 60 / bpm)
+    for t in times:
+        i = int(round(t * rate))
+        samples[i:i + len(click)] += click[:len(samples) - i]
+    return samples, times
+
+def check_click_track(bpms=(90, 120, 150), firsts=(0.5, 0.517)):
+    # Worst beat-time error (seconds) over synthetic click tracks
+    worst = 0.0
+    for bpm in bpms:
+        for first in firsts:
+            samples, times = click_track(bpm, first)
+            env = onset_envelope(samples, TARGET_RATE, workers=1)
+            frame_rate = TARGET_RATE / HOP
+            grid, _ = beat_grid(env, estimate_tempo(env, frame_rate))
+            beats = frames_to_seconds(grid, TARGET_RATE)
+            errors = [np.min(np.abs(beats - t)) for t in times if beats[0] - 0.1 <= t <= beats[-1] + 0.1]
+            if len(errors) < len(times) - 2: return float("inf") # Lost beats
+            worst = max(worst, max(errors))
+    return worst
+
+def analyze(path, workers=None, progress=None, use_cache=True):
+    digest = file_digest(path)
+    cache_path = data_path("analysis", f"{digest}.json")
+    if use_cache:
+        cached = read_json(cache_path)
+        if cached and cached.get("version") == ANALYSIS_VERSION:
+            if progress: progress(1.0)
+            return cached
+
+    started = time.perf_counter()
+    samples, rate = load_audio(path)
+    duration = len(samples) / rate
+    samples, rate = decimate(np.ascontiguousarray(samples, dtype=np.float32), rate)
+    env = onset_envelope(samples, rate, workers, progress)
+    frame_rate = rate / HOP
+    period = estimate_tempo(env, frame_rate) if len(env) > 4 else 60 * frame_rate / 120
+    grid, period = beat_grid(env, period) if len(env) > 4 else (np.zeros(0), period)
+
+    result = {
+        "version": ANALYSIS_VERSION,
+        "digest": digest,
+        "file": os.path.basename(path),
+        "duration": duration,
+        "tempo": 60 * frame_rate / period,
+        "beats": [round(t, 4) for t in frames_to_seconds(grid, rate).tolist()],
+        "onsets": [round(t, 4) for t in frames_to_seconds(pick_onsets(env, frame_rate), rate).tolist()],
+        "analysis_seconds": time.perf_counter() - started,
+    }
+    try:
+        atomic_write_json(cache_path, result)
+    except OSError as e:
+        print(f"Analysis cache write failed: {e}")
+    return result
+
+class AnalysisJob:
+    # Runs analyze() on a daemon thread so the window keeps drawing; the
+    # heavy lifting happens in the process pool
+    def __init__(self, path, workers=None):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.progress = 0.0
+        self.future = Future()
+        threading.Thread(target=self._work, args=(workers,), daemon=True).start()
+
+    def _work(self, workers):
+        try:
+            self.future.set_result(analyze(self.path, workers, progress=self._on_progress))
+        except Exception as e:
+            self.future.set_exception(e)
+
+    def _on_progress(self, fraction):
+        self.progress = fraction
+
+    def done(self):
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate tempo, beats and onsets of an audio file.")
+    parser.add_argument("path", nargs="?")
+    parser.add_argument("--check", action="store_true", help="check beat timing on synthetic click tracks")
+    parser.add_argument("--workers", type=int, help="process pool size (default: up to 4)")
+    parser.add_argument("--no-cache", action="store_true", help="analyze even if a cached result exists")
+    args = parser.parse_args()
+    if args.check:
+        worst = check_click_track()
+        print(f"Click tracks: beats within {worst * 1000:.1f} ms (tolerance {CHECK_TOLERANCE * 1000:.0f} ms)")
+        sys.exit(0 if worst <= CHECK_TOLERANCE else 1)
+    if not args.path: parser.error("no audio file given")
+
+    started = time.perf_counter()
+    result = analyze(args.path, args.workers, use_cache=not args.no_cache)
+    elapsed = time.perf_counter() - started
+    print(f"{result['file']}: {result['duration']:.1f}s, {result['tempo']:.1f} BPM, "
+          f"{len(result['beats'])} beats, {len(result['onsets'])} onsets ({elapsed:.2f}s)")
+    sys.exit(0)
@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+# Headless: SDL dummy drivers, and a throwaway data dir so the real level cache is untouched
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("NEURALFLOW_HOME", tempfile.mkdtemp(prefix="neuralflow-bench-"))
+os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1" # Keep stdout pure JSON
+# The first frame sets up the level generator, which probes and warms Ollama;
+# point it at a port nobody listens on so a running server is never touched
+os.environ["OLLAMA_HOST"] = "http://127.0.0.1:9"
+
+import pygame
+import main
+from architect import DIFFICULTY_SETTINGS
+from simulation import RhythmSim, bot_player, lane_count, lane_x
+
+SYNTH_LEVEL = {
+    "palette": {"bg": [15, 10, 30], "lane": [90, 40, 160], "note": [0, 255, 200], "hit": [255, 255, 255]},
+    "speed": 10,
+    "bpm": 120,
+    "name": "Benchmark Grid",
+    "introtext": "Synthetic level used by bench.py.",
+    "flavor_text": "No LLM involved.",
+}
+
+def top_bpm(difficulty):
+    return int(DIFFICULTY_SETTINGS[difficulty]["bpm"].split("-")[1])
+
+def scenarios():
+    result = []
+    for mode in ["2K", "4K", "OSU"]:
+        for difficulty in DIFFICULTY_SETTINGS:
+            result.append({"name": f"{mode}-{difficulty}", "mode": mode, "bpm": top_bpm(difficulty)})
+    overload = top_bpm("OVERLOAD")
+    result += [
+        {"name": "4K-dense-2000", "mode": "4K", "bpm": overload, "notes": 2000},
+        {"name": "OSU-dense-300", "mode": "OSU", "bpm": overload, "notes": 300},
+        {"name": "4K-particle-storm", "mode": "4K", "bpm": overload, "bursts": 40},
+        {"name": "4K-long-shake", "mode": "4K", "bpm": overload, "shake": True},
+        {"name": "4K-1080p", "mode": "4K", "bpm": overload, "size": (1920, 1080)},
+        {"name": "4K-2160p", "mode": "4K", "bpm": overload, "size": (3840, 2160)},
+        {"name": "OSU-2160p-shake", "mode": "OSU", "bpm": overload, "size": (3840, 2160), "shake": True},
+        {"name": "4K-2160p-native", "mode": "4K", "bpm": overload, "size": (3840, 2160), "render": (3840, 2160)},
+        {"name": "OSU-2160p-native-shake", "mode": "OSU", "bpm": overload, "size": (3840, 2160), "render": (3840, 2160), "shake": True},
+    ]
+    return result
+
+class ScenarioDriver:
+    # Puts a RhythmGame straight into GAME with a synthetic level and feeds it
+    # bot input plus whatever extra load the scenario asks for.
+    def __init__(self, game, spec, seed=0):
+        self.game = game
+        self.spec = spec
+        self.rng = random.Random(seed)
+        # "render" is the game's internal resolution, "size" the window it is scaled to
+        w, h = spec.get("render", (800, 600))
+        game.set_render_size(w, h)
+        game.resize(*spec.get("size", (w, h)))
+        game.active_mode = spec["mode"]
+        game.level_data = dict(SYNTH_LEVEL, bpm=spec["bpm"])
+        game.sim = RhythmSim(spec["mode"], game.level_data, w, h, game.user_speed, seed=seed, clock=game.game_time)
+        game.particles.clear()
+        game.state = "GAME"
+        self.bot = bot_player(seed, timing_sigma=0.03)
+        self.last_t = game.game_time()
+
+    def before_frame(self):
+        game, sim, spec = self.game, self.game.sim, self.spec
+        now = game.game_time()
+        game.lane_pressed = [False] * 4
+        for event in self.bot(sim, self.last_t, now):
+            sim.handle(event)
+            if event.kind == "press": game.lane_pressed[event.lane] = True
+        self.last_t = now
+
+        target = spec.get("notes", 0)
+        while len(sim.notes) < target:
+            t = now + self.rng.uniform(0.3, 3.0)
+            if sim.mode == "OSU":
+                slot = sim.notes.add(self.rng.randint(100, sim.width - 100), self.rng.randint(150, sim.height - 150), -1, t)
+            else:
+                lane = self.rng.randrange(lane_count(sim.mode))
+                slot = sim.notes.add(lane_x(sim.mode, lane, sim.width), 0, lane, t)
+            sim.index.add(slot)
+
+        for _ in range(spec.get("bursts", 0)):
+            game.particles.emit(self.rng.uniform(0, sim.width), self.rng.uniform(0, sim.height), SYNTH_LEVEL["palette"]["hit"])
+
+        if spec.get("shake"):
+            game.trigger_shake(8, 10)
+
+    def after_frame(self):
+        # Keep the run going no matter how badly the bot does
+        self.game.sim.hp = 100
+        self.game.sim.dead = False
+        self.game.state = "GAME"
+
+def run_scenario(game, spec, frames, warmup):
+    driver = ScenarioDriver(game, spec)
+    for _ in range(warmup):
+        driver.before_frame(); game.frame(); driver.after_frame()
+
+    times = []
+    allocs_before = main.ALLOCS.total
+    blocks_before = sys.getallocatedblocks()
+    for _ in range(frames):
+        driver.before_frame()
+        started = time.perf_counter()
+        game.frame()
+        times.append(time.perf_counter() - started)
+        driver.after_frame()
+    surface_allocs = main.ALLOCS.total - allocs_before
+    blocks = sys.getallocatedblocks() - blocks_before
+
+    # Separate short pass for memory, since tracemalloc skews timings
+    tracemalloc.start()
+    for _ in range(min(frames, 60)):
+        driver.before_frame(); game.frame(); driver.after_frame()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times.sort()
+    total = sum(times)
+    return {
+        "fps": frames / total,
+        "p50_ms": times[len(times) // 2] * 1000,
+        "p99_ms": times[min(len(times) - 1, int(len(times) * 0.99))] * 1000,
+        "max_ms": times[-1] * 1000,
+        "peak_mem_kb": peak / 1024,
+        "surface_allocs_per_frame": surface_allocs / frames,
+        "py_blocks_per_frame": blocks / frames,
+    }
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, cur in results.items():
+        base = baseline.get(name)
+        if not base: continue
+        if cur["fps"] < base["fps"] * (1 - tolerance):
+            regressions.append(f"{name}: fps {base['fps']:.0f} -> {cur['fps']:.0f}")
+        if cur["p99_ms"] > base["p99_ms"] * (1 + tolerance) and cur["p99_ms"] - base["p99_ms"] > 0.5:
+            regressions.append(f"{name}: p99 {base['p99_ms']:.2f} -> {cur['p99_ms']:.2f} ms")
+        if cur["surface_allocs_per_frame"] > base["surface_allocs_per_frame"] + 0.5:
+            regressions.append(f"{name}: surface allocs/frame {base['surface_allocs_per_frame']:.2f} -> {cur['surface_allocs_per_frame']:.2f}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless NEURALFLOW render/update benchmarks.")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=30)
+    parser.add_argument("--only", default="", help="run scenarios whose name contains this")
+    parser.add_argument("--out", help="write results JSON here (default: stdout)")
+    parser.add_argument("--baseline", default="bench_baseline.json", help="compare against this results file if it exists")
+    parser.add_argument("--save-baseline", action="store_true", help="overwrite the baseline with this run")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    game = main.RhythmGame()
+    results = {}
+    for spec in scenarios():
+        if args.only and args.only not in spec["name"]: continue
+        results[spec["name"]] = run_scenario(game, spec, args.frames, args.warmup)
+        r = results[spec["name"]]
+        print(f"{spec['name']:<20} {r['fps']:8.0f} fps  p99 {r['p99_ms']:6.2f} ms  peak {r['peak_mem_kb']:8.0f} KB  "
+              f"surf/frame {r['surface_allocs_per_frame']:.2f}", file=sys.stderr)
+    pygame.quit()
+
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f: f.write(output)
+    else:
+        print(output)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f: f.write(output)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions: print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,172 @@
+import os
+import sys
+import time
+import zlib
+import random
+import struct
+import argparse
+
+import numpy as np
+
+from storage import data_path, atomic_write_bytes
+
+# Precomputed note charts. A chart is the whole note sequence for a level,
+# built upfront and stored as a fixed-size binary header followed by packed
+# note records, so it can be memory-mapped and streamed by time instead of
+# being rolled note by note during play.
+
+CHART_MAGIC = b"NFCH"
+CHART_VERSION = 1
+# magic, version, mode, bpm, seed, note count, loop length (seconds)
+CHART_HEADER = struct.Struct("<4sB3sdIId")
+# Times are seconds from the start of the run. lane is -1 for OSU circles,
+# whose x/y are stored as fractions (0-65535) of the playfield so a chart
+# fits any window size.
+CHART_DTYPE = np.dtype([("time", "<f4"), ("lane", "i1"), ("type", "u1"), ("x", "<u2"), ("y", "<u2")])
+NOTE_TAP = 0
+LANES = {"2K": 2, "4K": 4, "OSU": 0}
+LEAD_IN_BEATS = 2 # First note lands two beats after the start
+
+class Chart:
+    def __init__(self, mode, bpm, seed, notes, loop_length):
+        self.mode = mode
+        self.bpm = bpm
+        self.seed = seed
+        self.notes = notes # CHART_DTYPE array, sorted by time (may be a memmap)
+        self.loop_length = loop_length # Added to every time on each pass, for endless play
+
+    def __len__(self):
+        return len(self.notes)
+
+    def to_bytes(self):
+        header = CHART_HEADER.pack(CHART_MAGIC, CHART_VERSION, self.mode.encode("ascii"), self.bpm,
+                                   self.seed, len(self.notes), self.loop_length)
+        return header + np.ascontiguousarray(self.notes, dtype=CHART_DTYPE).tobytes()
+
+    def save(self, path):
+        atomic_write_bytes(path, self.to_bytes())
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(path, "rb") as f:
+            raw = f.read(CHART_HEADER.size)
+        mode, bpm, seed, count, loop_length = parse_header(raw)
+        if mmap and count:
+            notes = np.memmap(path, dtype=CHART_DTYPE, mode="r", offset=CHART_HEADER.size, shape=(count,))
+        else:
+            with open(path, "rb") as f:
+                f.seek(CHART_HEADER.size)
+                notes = np.frombuffer(f.read(count * CHART_DTYPE.itemsize), dtype=CHART_DTYPE)
+        if len(notes) != count:
+            raise ValueError("truncated chart")
+        return cls(mode, bpm, seed, notes, loop_length)
+
+    @classmethod
+    def from_bytes(cls, data):
+        mode, bpm, seed, count, loop_length = parse_header(data[:CHART_HEADER.size])
+        notes = np.frombuffer(data, dtype=CHART_DTYPE, count=count, offset=CHART_HEADER.size)
+        return cls(mode, bpm, seed, notes, loop_length)
+
+def parse_header(raw):
+    if len(raw) < CHART_HEADER.size:
+        raise ValueError("not a chart file")
+    magic, version, mode, bpm, seed, count, loop_length = CHART_HEADER.unpack(raw)
+    if magic != CHART_MAGIC or version != CHART_VERSION:
+        raise ValueError("not a chart file")
+    return mode.rstrip(b"\0").decode("ascii"), bpm, seed, count, loop_length
+
+def generate_chart(mode, bpm, seed=None, beats=1024):
+    # One tap per beat, random lane (or circle position for OSU), from beat
+    # LEAD_IN_BEATS on. Looping after `beats` beats keeps the grid unbroken.
+    seed = seed if seed is not None else random.randrange(2**32)
+    rng = np.random.default_rng(seed)
+    beat_interval = 60 / bpm
+    notes = np.zeros(beats, dtype=CHART_DTYPE)
+    notes["time"] = (np.arange(beats) + LEAD_IN_BEATS) * beat_interval
+    notes["type"] = NOTE_TAP
+    if mode == "OSU":
+        notes["lane"] = -1
+        notes["x"] = rng.integers(0, 65536, beats)
+        notes["y"] = rng.integers(0, 65536, beats)
+    else:
+        notes["lane"] = rng.integers(0, LANES[mode], beats)
+    return Chart(mode, float(bpm), seed, notes, beats * beat_interval)
+
+def chart_from_beats(mode, beats, duration, seed=None, lead_in=1.0):
+    # One tap on each analyzed beat of a custom track (times in seconds from
+    # the start of the audio). Beats inside the first `lead_in` seconds are
+    # dropped so notes don't appear already halfway down; the chart loops
+    # with the track.
+    beats = np.asarray(beats, dtype=np.float64)
+    beats = beats[beats >= lead_in]
+    seed = seed if seed is not None else random.randrange(2**32)
+    rng = np.random.default_rng(seed)
+    bpm = 60 / float(np.median(np.diff(beats))) if len(beats) > 1 else 120.0
+    notes = np.zeros(len(beats), dtype=CHART_DTYPE)
+    notes["time"] = beats
+    notes["type"] = NOTE_TAP
+    if mode == "OSU":
+        notes["lane"] = -1
+        notes["x"] = rng.integers(0, 65536, len(beats))
+        notes["y"] = rng.integers(0, 65536, len(beats))
+    else:
+        notes["lane"] = rng.integers(0, LANES[mode], len(beats))
+    return Chart(mode, bpm, seed, notes, float(duration))
+
+def level_seed(level_data, mode):
+    # Same level, same chart: lets a generated level be shared or replayed
+    key = f"{level_data.get('name', '')}|{mode}|{level_data.get('bpm', 120)}"
+    return zlib.crc32(key.encode("utf-8"))
+
+def chart_path(mode, bpm, seed):
+    return data_path("charts", f"{mode}-{float(bpm):g}-{seed:08x}.nfc")
+
+def chart_for_level(level_data, mode, music=None):
+    # Load the level's chart from disk, generating and saving it on first use.
+    # With a custom track's analysis (see audio_analysis.py), notes follow its
+    # beat grid and the chart is keyed by the audio's content hash.
+    if music:
+        seed = zlib.crc32(f"{music['digest']}|{mode}".encode("ascii"))
+        path = data_path("charts", f"{mode}-{music['digest'][:16]}-a{music['version']}.nfc")
+    else:
+        bpm = level_data.get("bpm", 120)
+        seed = level_seed(level_data, mode)
+        path = chart_path(mode, bpm, seed)
+    try:
+        return Chart.load(path)
+    except (OSError, ValueError):
+        pass
+    if music:
+        chart = chart_from_beats(mode, music["beats"], music["duration"], seed)
+    else:
+        chart = generate_chart(mode, bpm, seed)
+    try:
+        chart.save(path)
+    except OSError as e:
+        print(f"Chart save failed: {e}")
+    return chart
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate or inspect NEURALFLOW chart files.")
+    parser.add_argument("--info", metavar="PATH", help="print a chart file's header and first notes")
+    parser.add_argument("--mode", default="4K", choices=list(LANES))
+    parser.add_argument("--bpm", type=float, default=120)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--beats", type=int, default=1024)
+    parser.add_argument("--out", help="output path (default: the chart directory)")
+    args = parser.parse_args()
+
+    if args.info:
+        started = time.perf_counter()
+        chart = Chart.load(args.info)
+        elapsed = time.perf_counter() - started
+        print(f"{chart.mode} {chart.bpm:g} BPM seed {chart.seed}: {len(chart)} notes, loops every {chart.loop_length:.1f}s "
+              f"(loaded in {elapsed * 1000:.2f} ms)")
+        for note in chart.notes[:8]:
+            print(f"  t={note['time']:.3f} lane={note['lane']} x={note['x']} y={note['y']}")
+        sys.exit(0)
+
+    chart = generate_chart(args.mode, args.bpm, args.seed, args.beats)
+    path = args.out or chart_path(chart.mode, chart.bpm, chart.seed)
+    chart.save(path)
+    print(f"Wrote {len(chart)} notes ({os.path.getsize(path)} bytes) to {path}")
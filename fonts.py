@@ -0,0 +1,51 @@
+import os
+import pygame
+
+from storage import data_path, atomic_write_json, read_json
+
+# pygame.font.SysFont builds a list of every installed font the first time it
+# is called (on Linux by running fc-list), which can take longer than the rest
+# of startup put together. The file SysFont picks for each name and style is
+# remembered in one small JSON file, so later launches open it directly.
+# Delete the file after installing the font to pick it up.
+
+FONT_CACHE_VERSION = 1
+
+class FontResolver:
+    def __init__(self, path=None):
+        self.path = path or data_path("fonts.json")
+        data = read_json(self.path, {})
+        self.entries = data.get("fonts", {}) if data.get("version") == FONT_CACHE_VERSION else {} # key -> {"path", "bold", "italic"}
+        self.hits = 0
+        self.misses = 0
+
+    def font(self, name, size, bold=False, italic=False):
+        key = f"{name.lower()}|{int(bold)}|{int(italic)}"
+        entry = self.entries.get(key)
+        if entry is not None and (entry["path"] is None or os.path.exists(entry["path"])):
+            try:
+                font = self._open(entry, size)
+                self.hits += 1
+                return font
+            except (OSError, pygame.error):
+                pass # Replaced or corrupt since it was cached; resolve again
+        self.misses += 1
+        picked = {}
+        def capture(path, size, set_bold, set_italic):
+            picked.update(path=path, bold=set_bold, italic=set_italic)
+            return self._open(picked, size)
+        font = pygame.font.SysFont(name, size, bold, italic, constructor=capture)
+        self.entries[key] = picked
+        try:
+            atomic_write_json(self.path, {"version": FONT_CACHE_VERSION, "fonts": self.entries})
+        except OSError as e:
+            print(f"Font cache write failed: {e}")
+        return font
+
+    @staticmethod
+    def _open(entry, size):
+        # What SysFont's default constructor does; a None path is pygame's own font
+        font = pygame.font.Font(entry["path"], size)
+        font.set_bold(entry["bold"])
+        font.set_italic(entry["italic"])
+        return font
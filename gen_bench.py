@@ -0,0 +1,304 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import contextlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Offline, so no real Ollama and a throwaway data dir for the level cache and model stats
+os.environ.setdefault("NEURALFLOW_HOME", tempfile.mkdtemp(prefix="neuralflow-genbench-"))
+
+from architect import LevelArchitect
+from level_cache import LevelCache
+
+# Level generation benchmark against FakeOllama, a local stand-in for the
+# Ollama HTTP API with configurable latency, token rate, failures and
+# malformed output. Everything is seeded, so runs are comparable offline.
+
+FAKE_LEVEL = {
+    "palette": {"bg": [12, 8, 30], "lane": [70, 40, 140], "note": [0, 255, 200], "hit": [255, 255, 255]},
+    "speed": 8,
+    "bpm": 128,
+    "name": "Stand-in Grid",
+    "introtext": "A synthetic world served by the benchmark's fake model server. Nothing here was generated.",
+    "flavor_text": "Latency is simulated.",
+}
+DEFECTS = ("trailing_comma", "truncated", "string_numbers", "non_finite", "missing_text")
+
+def malformed(text, level, kind):
+    if kind == "trailing_comma": return text[:-1] + ",}"
+    if kind == "truncated": return text[:text.index('"flavor_text"') + 18]
+    if kind == "string_numbers":
+        broken = {**level, "bpm": str(level["bpm"]), "palette": {**level["palette"], "hit": "#ffffff"}}
+        return json.dumps(broken)
+    if kind == "non_finite":
+        # Python's json writes these as the bare tokens NaN and Infinity
+        broken = {**level, "bpm": float("nan"), "speed": "1e999", "palette": {**level["palette"], "hit": [float("inf"), 0, 0]}}
+        return json.dumps(broken)
+    broken = dict(level)
+    del broken["introtext"]
+    return json.dumps(broken)
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients drop pooled connections and cancelled streams all the time
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+class FakeOllama:
+    # /api/tags, /api/ps and /api/generate (streaming and not). Replies wait
+    # `latency` seconds, then emit the text at `token_rate` tokens/s (a token
+    # being 4 characters). `failure_rate` answers HTTP 500, `malformed_rate`
+    # returns one of DEFECTS. Requests for a few named fields (the level
+    # repair path) get just those fields.
+    def __init__(self, latency=0.2, token_rate=400, failure_rate=0.0, malformed_rate=0.0, cold_start=0.0,
+                 models=("fake-small", "fake-large"), seed=0, port=0):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.failure_rate = failure_rate
+        self.malformed_rate = malformed_rate
+        self.cold_start = cold_start
+        self.models = list(models)
+        self.loaded = set()
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"level": 0, "fields": 0, "load": 0, "failed": 0, "malformed": 0}
+        self.server = QuietServer(("127.0.0.1", port), self._handler())
+        self.host = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _roll(self, rate):
+        with self.lock:
+            return self.rng.random() < rate
+
+    def _count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def _response_text(self, prompt):
+        if "exactly these string fields" in prompt:
+            self._count("fields")
+            return json.dumps({k: FAKE_LEVEL[k] for k in ("name", "introtext", "flavor_text")})
+        self._count("level")
+        text = json.dumps(FAKE_LEVEL)
+        if self._roll(self.malformed_rate):
+            self._count("malformed")
+            with self.lock:
+                kind = self.rng.choice(DEFECTS)
+            text = malformed(text, FAKE_LEVEL, kind)
+        return text
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, obj, status=200):
+                body = json.dumps(obj).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _chunk(self, obj):
+                line = (json.dumps(obj) + "\n").encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._json({"models": [{"name": m} for m in fake.models]})
+                elif self.path == "/api/ps":
+                    self._json({"models": [{"name": m} for m in sorted(fake.loaded)]})
+                else:
+                    self._json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                if self.path != "/api/generate":
+                    return self._json({"error": "not found"}, 404)
+                req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                model = req.get("model")
+                if req.get("keep_alive") == 0:
+                    fake.loaded.discard(model)
+                    return self._json({"model": model, "response": "", "done": True})
+                if model not in fake.loaded:
+                    time.sleep(fake.cold_start)
+                    fake.loaded.add(model)
+                if not req.get("prompt"):
+                    fake._count("load")
+                    return self._json({"model": model, "response": "", "done": True})
+                if fake._roll(fake.failure_rate):
+                    fake._count("failed")
+                    return self._json({"error": "simulated failure"}, 500)
+
+                text = fake._response_text(req["prompt"])
+                time.sleep(fake.latency)
+                if not req.get("stream", True):
+                    time.sleep(len(text) / 4 / fake.token_rate)
+                    return self._json({"model": model, "response": text, "done": True})
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for i in range(0, len(text), 4):
+                        time.sleep(1 / fake.token_rate)
+                        self._chunk({"model": model, "response": text[i:i + 4], "done": False})
+                    self._chunk({"model": model, "response": "", "done": True})
+                    self.wfile.write(b"0\r\n\r\n")
+                except ConnectionError:
+                    pass # Client stopped reading (cancelled, or the object was complete)
+
+        return Handler
+
+def scenarios():
+    return [
+        {"name": "stream", "stream": True},
+        {"name": "non-stream", "stream": False},
+        {"name": "stream-malformed-30", "stream": True, "malformed_rate": 0.3},
+        {"name": "non-stream-malformed-30", "stream": False, "malformed_rate": 0.3},
+        {"name": "stream-fail-10", "stream": True, "failure_rate": 0.1},
+        {"name": "stream-concurrency-4", "stream": True, "concurrency": 4},
+        {"name": "stream-concurrency-8", "stream": True, "concurrency": 8},
+        {"name": "race-2", "stream": True, "race": True, "malformed_rate": 0.3},
+        {"name": "cached", "stream": True, "cached": True},
+    ]
+
+def percentile(values, q):
+    if not values: return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+def run_scenario(spec, levels, latency, token_rate, seed=0):
+    fake = FakeOllama(latency=latency, token_rate=token_rate, failure_rate=spec.get("failure_rate", 0.0),
+                      malformed_rate=spec.get("malformed_rate", 0.0), seed=seed).start()
+    # LevelArchitect logs every request; keep stdout for the results JSON
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            return measure(fake, spec, levels)
+        finally:
+            fake.stop()
+
+def measure(fake, spec, levels):
+    architect = LevelArchitect(host=fake.host)
+    architect.probed.wait(5)
+    architect.cache = LevelCache(path=os.path.join(tempfile.mkdtemp(prefix="cache-", dir=os.environ["NEURALFLOW_HOME"]), "levels.json"))
+    architect.stream = spec["stream"]
+    architect.race = spec.get("race", False)
+    architect.model = fake.models[0]
+    if spec.get("cached"):
+        for i in range(levels): architect.generate_level(f"theme {i}", "4K", "FLOW")
+
+    totals, first_fields, failures = [], [], 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal failures
+        started = time.perf_counter()
+        first = []
+        level = architect.generate_level(f"theme {i}", "4K", "FLOW", use_cache=spec.get("cached", False),
+                                         on_field=lambda k, v: first or first.append(time.perf_counter()))
+        elapsed = time.perf_counter() - started
+        with lock:
+            totals.append(elapsed)
+            if first: first_fields.append(first[0] - started)
+            if level.get("name") == "Offline Protocol": failures += 1
+
+    counts_before = dict(fake.counts)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=spec.get("concurrency", 1)) as pool:
+        list(pool.map(one, range(levels)))
+    wall = time.perf_counter() - started
+    requests_made = {k: fake.counts[k] - counts_before[k] for k in fake.counts}
+
+    return {
+        "levels": levels,
+        "throughput_lps": levels / wall,
+        "p50_ms": percentile(totals, 0.5) * 1000,
+        "p99_ms": percentile(totals, 0.99) * 1000,
+        "first_field_p50_ms": percentile(first_fields, 0.5) * 1000 if first_fields else None,
+        "first_field_p99_ms": percentile(first_fields, 0.99) * 1000 if first_fields else None,
+        "retries_per_level": requests_made["fields"] / levels,
+        "server_failures": requests_made["failed"],
+        "malformed": requests_made["malformed"],
+        "fallback_levels": failures,
+    }
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, cur in results.items():
+        base = baseline.get(name)
+        if not base: continue
+        for key in ("p50_ms", "p99_ms", "first_field_p50_ms"):
+            if cur.get(key) is None or base.get(key) is None: continue
+            if cur[key] > base[key] * (1 + tolerance) and cur[key] - base[key] > 5:
+                regressions.append(f"{name}: {key} {base[key]:.1f} -> {cur[key]:.1f}")
+        if cur["throughput_lps"] < base["throughput_lps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {base['throughput_lps']:.2f} -> {cur['throughput_lps']:.2f} levels/s")
+        if cur["retries_per_level"] > base["retries_per_level"] + 0.05:
+            regressions.append(f"{name}: retries/level {base['retries_per_level']:.2f} -> {cur['retries_per_level']:.2f}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline LevelArchitect latency/throughput benchmarks against a fake Ollama.")
+    parser.add_argument("--levels", type=int, default=40, help="generations per scenario")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake time before the first token (seconds)")
+    parser.add_argument("--token-rate", type=float, default=2000, help="fake tokens per second")
+    parser.add_argument("--only", default="", help="run scenarios whose name contains this")
+    parser.add_argument("--out", help="write results JSON here (default: stdout)")
+    parser.add_argument("--baseline", default="gen_bench_baseline.json", help="compare against this results file if it exists")
+    parser.add_argument("--save-baseline", action="store_true", help="overwrite the baseline with this run")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="just run the fake server (point OLLAMA_HOST at it)")
+    args = parser.parse_args()
+
+    if args.serve:
+        fake = FakeOllama(latency=args.latency, token_rate=args.token_rate, port=args.serve).start()
+        print(f"Fake Ollama on {fake.host}, Ctrl+C to stop", file=sys.stderr)
+        try:
+            while True: time.sleep(1)
+        except KeyboardInterrupt:
+            fake.stop()
+        sys.exit(0)
+
+    results = {}
+    for spec in scenarios():
+        if args.only and args.only not in spec["name"]: continue
+        r = results[spec["name"]] = run_scenario(spec, args.levels, args.latency, args.token_rate)
+        first = f"{r['first_field_p50_ms']:7.1f}" if r["first_field_p50_ms"] is not None else "      -"
+        print(f"{spec['name']:<24} p50 {r['p50_ms']:7.1f} ms  p99 {r['p99_ms']:7.1f} ms  first field {first} ms  "
+              f"{r['throughput_lps']:6.2f} lvl/s  retries {r['retries_per_level']:.2f}", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f: f.write(output)
+    else:
+        print(output)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f: f.write(output)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions: print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
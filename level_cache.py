@@ -0,0 +1,148 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+
+from storage import data_path, atomic_write_json, read_json
+
+ORDER_SAVE_DELAY = 5.0 # Seconds a hit's new LRU order may wait before it's written
+
+class LevelCache:
+    # Persistent LRU cache of generated levels, keyed by
+    # (normalized theme, mode, difficulty, model). The whole cache is one JSON
+    # file rewritten atomically on every content change. Hits only reorder
+    # entries, so that write is deferred and batched. Files are always written
+    # outside self.lock, which the main thread takes every menu frame (peek).
+    def __init__(self, path=None, max_entries=200, max_bytes=1024 * 1024, ttl=None):
+        self.path = path or data_path("level_cache.json")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl # seconds, None = never expire
+        self.entries = OrderedDict() # key -> {"level", "created", "size"}, oldest use first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock() # Serializes file writes
+        self.snapshots = 0 # Sequence number of the last snapshot taken
+        self.written = 0 # ... and of the last one written
+        self.order_dirty = False
+        self.order_timer = None
+        self._load()
+
+    @staticmethod
+    def make_key(theme, mode, difficulty, model):
+        theme = " ".join(theme.lower().split())
+        return f"{theme}|{mode}|{difficulty}|{model}"
+
+    def _load(self):
+        data = read_json(self.path, {})
+        for entry in data.get("entries", []):
+            try:
+                self.entries[entry["key"]] = {"level": entry["level"], "created": entry["created"], "size": entry["size"]}
+                self.total_bytes += entry["size"]
+            except (KeyError, TypeError):
+                continue
+
+    def _save(self):
+        # Snapshot under the lock, write without it. A snapshot older than
+        # one already written is dropped.
+        with self.lock:
+            self.snapshots += 1
+            seq = self.snapshots
+            entries = [{"key": k, **v} for k, v in self.entries.items()]
+            self.order_dirty = False
+        with self.save_lock:
+            if seq < self.written: return
+            try:
+                atomic_write_json(self.path, {"version": 1, "entries": entries})
+                self.written = seq
+            except OSError as e:
+                print(f"Level cache write failed: {e}")
+
+    def _order_changed(self):
+        # Called with self.lock held
+        self.order_dirty = True
+        if self.order_timer is None:
+            self.order_timer = threading.Timer(ORDER_SAVE_DELAY, self._save_order)
+            self.order_timer.daemon = True
+            self.order_timer.start()
+
+    def _save_order(self):
+        with self.lock:
+            self.order_timer = None
+            if not self.order_dirty: return
+        self._save()
+
+    def flush(self):
+        # Write a pending LRU order now, e.g. on exit
+        if self.order_dirty: self._save()
+
+    def _expired(self, entry):
+        return self.ttl is not None and time.time() - entry["created"] > self.ttl
+
+    def _drop(self, key):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry["size"]
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or self._expired(entry):
+                self.misses += 1
+                if entry is None: return None
+                self._drop(key)
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                self._order_changed()
+                return json.loads(json.dumps(entry["level"])) # Callers get their own copy
+        self._save()
+        return None
+
+    def peek(self, key):
+        # Like get, but doesn't touch stats or LRU order
+        with self.lock:
+            entry = self.entries.get(key)
+            return None if entry is None or self._expired(entry) else entry["level"]
+
+    def put(self, key, level):
+        size = len(json.dumps(level, separators=(",", ":")))
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = {"level": level, "created": time.time(), "size": size}
+            self.total_bytes += size
+            while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+        self._save()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+        self._save()
+
+    def recent_themes(self, limit=8):
+        # Distinct normalized themes, most recently used first
+        with self.lock:
+            themes = []
+            for key in reversed(self.entries):
+                theme = key.split("|", 1)[0]
+                if theme not in themes: themes.append(theme)
+                if len(themes) >= limit: break
+            return themes
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,207 @@
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+import contextlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from storage import data_path
+from level_schema import is_valid_level
+
+# Pre-generated level packs, for machines without an LLM. A pack is one JSON
+# Lines file: a header line, then one line per (theme, mode, difficulty)
+# level. Lines are appended and synced as each level finishes, so an
+# interrupted bake loses at most the line being written and the next run
+# picks up where it stopped. Loading reads the whole file into a dict index.
+# This module and its CLI never import pygame.
+
+PACK_FORMAT = "neuralflow-pack"
+PACK_VERSION = 1
+PACK_SUFFIX = ".nfpack"
+MODES = ("2K", "4K", "OSU")
+DIFFICULTIES = ("CHILL", "FLOW", "NEURAL", "OVERLOAD")
+
+def pack_key(theme, mode, difficulty):
+    # Theme normalized the same way as LevelCache keys
+    theme = " ".join(theme.lower().split())
+    return f"{theme}|{mode}|{difficulty}"
+
+class LevelPack:
+    def __init__(self, path):
+        self.path = path
+        self.levels = {} # key -> level
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                lines = f.read().splitlines() # Decoded per line: a cut-off last line may end mid-character
+        except FileNotFoundError:
+            return
+        if not lines: return
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            header = None
+        if not isinstance(header, dict) or header.get("format") != PACK_FORMAT or header.get("version") != PACK_VERSION:
+            raise ValueError(f"{self.path}: not a level pack")
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+                key, level = entry["key"], entry["level"]
+            except (ValueError, KeyError, TypeError):
+                continue # A line cut off by an interrupted bake
+            if is_valid_level(level): self.levels[key] = level
+
+    def __len__(self):
+        return len(self.levels)
+
+    def __contains__(self, key):
+        return key in self.levels
+
+    def get(self, theme, mode, difficulty):
+        level = self.levels.get(pack_key(theme, mode, difficulty))
+        return None if level is None else json.loads(json.dumps(level)) # Callers get their own copy
+
+    def pick(self, theme, mode, difficulty):
+        # Some level for a theme the pack doesn't have: the same mode and
+        # difficulty if possible, chosen by theme so it's stable between runs
+        exact = self.get(theme, mode, difficulty)
+        if exact is not None: return exact
+        keys = sorted(k for k in self.levels if k.endswith(f"|{mode}|{difficulty}")) or \
+               sorted(k for k in self.levels if f"|{mode}|" in k)
+        if not keys: return None
+        level = self.levels[keys[zlib.crc32(" ".join(theme.lower().split()).encode("utf-8")) % len(keys)]]
+        return json.loads(json.dumps(level))
+
+    def add(self, theme, mode, difficulty, level):
+        key = pack_key(theme, mode, difficulty)
+        line = json.dumps({"key": key, "theme": theme, "mode": mode, "difficulty": difficulty, "level": level},
+                          separators=(",", ":"))
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "ab+") as f:
+                if f.tell() == 0:
+                    f.write(json.dumps({"format": PACK_FORMAT, "version": PACK_VERSION}).encode("utf-8") + b"\n")
+                else:
+                    # Start on a fresh line after one an interrupted bake cut off
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n": f.write(b"\n")
+                f.write(line.encode("utf-8") + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.levels[key] = level
+
+def pack_files(directory=None):
+    directory = directory or data_path("packs")
+    if not os.path.isdir(directory): return []
+    return [os.path.join(directory, n) for n in sorted(os.listdir(directory)) if n.endswith(PACK_SUFFIX)]
+
+def load_packs(directory=None):
+    packs = []
+    for path in pack_files(directory):
+        try:
+            packs.append(LevelPack(path))
+        except (OSError, ValueError) as e:
+            print(f"Level pack skipped: {e}")
+    return packs
+
+def bake(architect, pack, themes, modes, difficulties, concurrency=4, progress=None):
+    # Generate every missing (theme, mode, difficulty) into `pack`, at most
+    # `concurrency` requests at a time. Every level is asked of the model,
+    # bypassing the player's cache and installed packs and not cached either;
+    # only complete ones are written, never offline fallbacks or stock-text
+    # stand-ins. Returns a summary.
+    jobs = [(t, m, d) for t in themes for m in modes for d in difficulties if pack_key(t, m, d) not in pack]
+    skipped = len(themes) * len(modes) * len(difficulties) - len(jobs)
+    done, failed = 0, 0
+
+    def work(theme, mode, difficulty):
+        result = {}
+        level = architect.generate_level(theme, mode, difficulty, use_cache=False, store=False,
+                                         on_result=lambda source, complete: result.update(source=source, complete=complete))
+        if result.get("source") != "model" or not result.get("complete"):
+            return False
+        pack.add(theme, mode, difficulty, level)
+        return True
+
+    started = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        futures = [pool.submit(work, *job) for job in jobs]
+        for future in as_completed(futures):
+            if future.result(): done += 1
+            else: failed += 1
+            if progress: progress(done, failed, len(jobs), time.perf_counter() - started)
+    finally:
+        # On Ctrl+C, drop the queue; requests in flight still finish and are saved
+        pool.shutdown(wait=False, cancel_futures=True)
+    elapsed = time.perf_counter() - started
+    return {"generated": done, "failed": failed, "skipped": skipped, "seconds": elapsed,
+            "levels_per_second": done / elapsed if elapsed else 0.0}
+
+def read_themes(args):
+    themes = list(args.themes)
+    if args.themes_file:
+        with open(args.themes_file, "r", encoding="utf-8") as f:
+            themes += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    unique = {}
+    for theme in themes: unique.setdefault(" ".join(theme.lower().split()), theme)
+    return list(unique.values())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate a NEURALFLOW level pack for playing without Ollama.")
+    parser.add_argument("themes", nargs="*", help="themes to generate")
+    parser.add_argument("--themes-file", help="file with one theme per line (# starts a comment)")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma-separated game modes")
+    parser.add_argument("--difficulties", default=",".join(DIFFICULTIES), help="comma-separated difficulties")
+    parser.add_argument("--out", default=data_path("packs", "levels" + PACK_SUFFIX), help="pack file to create or resume")
+    parser.add_argument("--concurrency", type=int, default=4, help="generations in flight at once")
+    parser.add_argument("--model", help="Ollama model (default: the fastest one seen so far)")
+    parser.add_argument("--host", help="Ollama server (default: $OLLAMA_HOST or localhost:11434)")
+    args = parser.parse_args()
+
+    modes = [m.strip().upper() for m in args.modes.split(",") if m.strip()]
+    difficulties = [d.strip().upper() for d in args.difficulties.split(",") if d.strip()]
+    bad = [m for m in modes if m not in MODES] + [d for d in difficulties if d not in DIFFICULTIES]
+    if bad: parser.error(f"unknown mode/difficulty: {', '.join(bad)}")
+    themes = read_themes(args)
+    if not themes: parser.error("no themes given")
+
+    from architect import LevelArchitect
+    import requests
+
+    architect = LevelArchitect(host=args.host)
+    # Room in the connection pool for every request in flight
+    architect.session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(8, args.concurrency)))
+    architect.probed.wait(5)
+    if not architect.online:
+        print(f"No Ollama server at {architect.host}", file=sys.stderr)
+        sys.exit(1)
+    if args.model: architect.select_model(args.model)
+
+    pack = LevelPack(args.out)
+    total = len(themes) * len(modes) * len(difficulties)
+    print(f"Baking {total} levels into {args.out} with {architect.model} ({len(pack)} already in the pack)", file=sys.stderr)
+
+    def report(done, failed, todo, elapsed):
+        rate = done / elapsed if elapsed else 0
+        print(f"\r{done + failed}/{todo}  {failed} failed  {rate:.2f} levels/s", end="", file=sys.stderr, flush=True)
+
+    try:
+        # LevelArchitect narrates every request; keep the output to progress and the summary
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            summary = bake(architect, pack, themes, modes, difficulties, args.concurrency, report)
+    except KeyboardInterrupt:
+        print(f"\nInterrupted; {len(pack)} levels saved, run again to resume", file=sys.stderr)
+        architect.model_stats.flush()
+        sys.exit(130)
+    architect.model_stats.flush()
+    print(file=sys.stderr)
+    print(f"{summary['generated']} generated, {summary['skipped']} already present, {summary['failed']} failed "
+          f"in {summary['seconds']:.1f}s ({summary['levels_per_second']:.2f} levels/s); pack has {len(pack)} levels")
+    sys.exit(1 if summary["failed"] else 0)
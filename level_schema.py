@@ -0,0 +1,156 @@
+import json
+import math
+
+# Level schema, validation and local repair. LLM output often comes back
+# almost right (a trailing comma, "255" instead of 255, a color out of range,
+# a missing palette entry); all of that is fixed here instead of discarding
+# the level. Only text fields can't be made up locally, so those are the ones
+# generate_level asks the model for again.
+
+LEVEL_KEYS = ("palette", "speed", "bpm", "name", "introtext", "flavor_text")
+PALETTE_KEYS = ("bg", "lane", "note", "hit")
+TEXT_KEYS = ("name", "introtext", "flavor_text")
+DEFAULT_PALETTE = {"bg": [20, 20, 30], "lane": [50, 50, 50], "note": [0, 255, 255], "hit": [255, 255, 255]}
+BPM_LIMITS = (40, 300) # Players may ask for their song's BPM, so only absurd values are clamped
+SPEED_LIMITS = (1, 20)
+
+def is_valid_level(level):
+    # Every field present and a palette the renderer can use as-is
+    if not isinstance(level, dict) or not all(k in level for k in LEVEL_KEYS): return False
+    return is_valid_palette(level["palette"])
+
+def is_valid_palette(palette):
+    return isinstance(palette, dict) and all(
+        isinstance(palette.get(k), list) and len(palette[k]) == 3 and all(type(c) is int and 0 <= c <= 255 for c in palette[k])
+        for k in PALETTE_KEYS)
+
+def strip_trailing_commas(text):
+    # Drop commas directly before a closing bracket, leaving strings alone
+    out = []
+    in_string = escape = False
+    for ch in text:
+        if in_string:
+            if escape: escape = False
+            elif ch == '\\': escape = True
+            elif ch == '"': in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in '}]':
+            while out and out[-1].isspace(): out.pop()
+            if out and out[-1] == ',': out.pop()
+        out.append(ch)
+    return "".join(out)
+
+def close_truncated(text):
+    # Keep the complete top-level pairs of a cut-off object and close it
+    depth = 0
+    in_string = escape = False
+    last_comma = None
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape: escape = False
+            elif ch == '\\': escape = True
+            elif ch == '"': in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in '{[':
+            depth += 1
+        elif ch in '}]':
+            depth -= 1
+            if depth == 0: return text[:i + 1]
+        elif ch == ',' and depth == 1:
+            last_comma = i
+    return text[:last_comma] + "}" if last_comma else "{}"
+
+def loads_lenient(text):
+    # json.loads after stripping chatter around the object, trailing commas
+    # and, for a cut-off response, the unfinished last pair
+    start = text.find('{')
+    if start == -1: raise ValueError("no JSON object in response")
+    text = text[start:]
+    end = text.rfind('}') + 1
+    try:
+        return json.loads(text[:end])
+    except ValueError:
+        pass
+    try:
+        return json.loads(strip_trailing_commas(text[:end]))
+    except ValueError:
+        return json.loads(strip_trailing_commas(close_truncated(text)))
+
+def parse_range(spec):
+    # "80-100" -> (80, 100), as used in DIFFICULTY_SETTINGS
+    lo, _, hi = str(spec).partition("-")
+    return int(lo), int(hi or lo)
+
+def to_number(value):
+    # A finite number, or None. json.loads accepts NaN and Infinity, and
+    # "1e999" parses to inf; none of them can be rounded to an int.
+    if isinstance(value, bool): return None
+    if isinstance(value, str):
+        try:
+            value = float(value.strip().rstrip("%"))
+        except ValueError:
+            return None
+    if isinstance(value, (int, float)) and math.isfinite(value): return value
+    return None
+
+def to_color(value):
+    # [r, g, b] of ints in 0-255 from lists of numbers or numeric strings,
+    # "#rrggbb", "r, g, b" or {"r": .., "g": .., "b": ..}; None if unusable
+    if isinstance(value, dict):
+        value = [value.get(k) for k in ("r", "g", "b")]
+    elif isinstance(value, str):
+        s = value.strip()
+        if s.startswith("#") and len(s) == 7:
+            try:
+                return [int(s[i:i + 2], 16) for i in (1, 3, 5)]
+            except ValueError:
+                return None
+        value = s.strip("()[]").split(",")
+    if not isinstance(value, (list, tuple)) or len(value) < 3: return None
+    channels = [to_number(c) for c in value[:3]]
+    if any(c is None for c in channels): return None
+    return [max(0, min(255, int(round(c)))) for c in channels]
+
+def repair_field(key, value):
+    # Repaired value for one top-level field, or None if it can't be fixed
+    if key == "palette":
+        if not isinstance(value, dict): return None
+        palette = {}
+        for k in PALETTE_KEYS:
+            palette[k] = to_color(value.get(k)) or list(DEFAULT_PALETTE[k])
+        return palette
+    if key in ("bpm", "speed"):
+        number = to_number(value)
+        if number is None: return None
+        lo, hi = BPM_LIMITS if key == "bpm" else SPEED_LIMITS
+        return max(lo, min(hi, int(round(number))))
+    if key in TEXT_KEYS:
+        if isinstance(value, (int, float)) and not isinstance(value, bool): value = str(value)
+        if not isinstance(value, str) or not value.strip(): return None
+        return value.strip()
+    return value
+
+def repair_level(level, difficulty):
+    # Returns (level, unfixable keys). Numbers and palette colors are always
+    # made valid, from the difficulty's ranges if need be; text fields that are
+    # missing or unusable are reported for a re-request.
+    level = dict(level) if isinstance(level, dict) else {}
+    for key in ("palette", "speed", "bpm"):
+        value = repair_field(key, level.get(key))
+        if value is None:
+            if key == "palette": value = {k: list(c) for k, c in DEFAULT_PALETTE.items()}
+            else:
+                lo, hi = parse_range(difficulty[key])
+                value = (lo + hi) // 2
+        level[key] = value
+    unfixable = []
+    for key in TEXT_KEYS:
+        value = repair_field(key, level.get(key))
+        if value is None:
+            level.pop(key, None)
+            unfixable.append(key)
+        else:
+            level[key] = value
+    return level, unfixable
@@ -1,145 +1,193 @@
+import time
+STARTUP_ORIGIN = time.perf_counter() # Before the imports below, which are most of a cold start
 import pygame
-import requests
 import random
-import json
 import math
+import os
+import argparse
+import threading
+from collections import OrderedDict
+
+from level_schema import is_valid_palette
+from simulation import RhythmSim, GameClock, lane_count, lane_x
+from chart import chart_for_level
+from audio_analysis import AnalysisJob, is_audio_file
+from replay import ReplayRecorder, save_replay
+from particles import ParticlePool
+from rendering import TextCache, LayerCache, DirtyPresenter, merge_rects, ResolutionController, ALLOCS, new_surface
+from profiler import FrameProfiler, StartupTimer
+from fonts import FontResolver
+from storage import data_path
 
 # --- CONFIGURATION ---
-WIDTH, HEIGHT = 800, 600
-FPS = 60
-
-class LevelArchitect:
-    def __init__(self):
-        self.url = "http://localhost:11434/api/generate"
-        self.available_models = []
-        self.model = "mistral"
-        self.online = True
-        self.check_connection()
-        self.refresh_available_models()
-
-    def check_connection(self):
-        try:
-            requests.get("http://localhost:11434/api/tags", timeout=1)
-            self.online = True
-        except:
-            self.online = False
-
-    def refresh_available_models(self):
-        if not self.online:
+WIDTH, HEIGHT = 800, 600 # Render resolution (--render-size); frames are scaled to the window
+FPS = 60 # Default render rate; --fps 0 draws uncapped
+INPUT_HZ = 1000 # Input polling and gameplay update rate between frames
+VISUAL_HZ = 60 # Tick rate of shake/judgment/particle timers
+COLORKEY = (255, 0, 254) # Transparent color for pre-rendered overlay layers
+
+# Methods timed by the frame profiler while it is enabled
+PROFILED_GAME_METHODS = ["update_game", "draw_epilepsy_warning", "draw_background_ambiance", "draw_title", "draw_menu",
+                         "draw_settings", "draw_input", "draw_loading", "draw_intro", "draw_countdown", "draw_game", "draw_death"]
+PROFILED_SIM_METHODS = ["spawn_note", "press", "click", "update"]
+MODEL_STATUS_COLORS = {"READY": (0, 200, 120), "LOADING": (255, 200, 100), "FAILED": (255, 50, 50), "COLD": (60, 60, 60)}
+JUDGMENT_COLORS = {"PERFECT": (0, 255, 255), "GREAT": (0, 255, 100), "GOOD": (255, 255, 100), "MISS": (255, 50, 50)}
+
+class LevelPrefetcher:
+    # Generates levels speculatively while the player is in MENU/SETTINGS/INPUT
+    # so ENTER can skip LOADING. Candidates are the theme being typed (after an
+    # idle debounce) followed by recently played themes. One job at a time so
+    # we never compete with a real generation for the LLM.
+    def __init__(self, architect, pool_size=3, debounce_ms=1200):
+        self.architect = architect
+        self.pool_size = pool_size
+        self.debounce_ms = debounce_ms
+        self.pool = OrderedDict() # cache key -> ready level_data
+        self.failed = set() # Keys whose prefetch came back incomplete; not retried for this target
+        self.job = None
+        self.job_key = None
+        self.target = None # (mode, difficulty, model)
+        self.recent_themes = architect.cache.recent_themes()
+        self.typed_text = ""
+        self.typed_at = 0
+        self.hits = 0
+        self.misses = 0
+
+    def remember_theme(self, theme):
+        theme = " ".join(theme.lower().split())
+        if theme in self.recent_themes: self.recent_themes.remove(theme)
+        self.recent_themes.insert(0, theme)
+        del self.recent_themes[8:]
+
+    def cancel(self):
+        if self.job:
+            self.job.cancel()
+        self.job = None
+        self.job_key = None
+
+    def update(self, mode, difficulty, typed_text=""):
+        target = (mode, difficulty, self.architect.model)
+        if target != self.target:
+            # Settings changed: everything queued or pooled is for the wrong level
+            self.cancel()
+            self.pool.clear()
+            self.failed.clear()
+            self.target = target
+
+        now = pygame.time.get_ticks()
+        if typed_text != self.typed_text:
+            self.typed_text = typed_text
+            self.typed_at = now
+
+        if self.job and self.job.done():
+            try:
+                level = self.job.result()
+                # Stand-ins (offline or failed requests) would turn a miss into a fake hit
+                if self.job.complete:
+                    self.pool[self.job_key] = level
+                    while len(self.pool) > self.pool_size: self.pool.popitem(last=False)
+                else:
+                    self.failed.add(self.job_key)
+            except Exception as e:
+                print(f"Prefetch failed: {e}")
+            self.job = None
+            self.job_key = None
+
+        if not self.architect.online: return
+
+        typed_ready = bool(self.typed_text.strip()) and now - self.typed_at > self.debounce_ms
+        candidates = ([self.typed_text] if typed_ready else []) + self.recent_themes
+
+        for i, theme in enumerate(candidates):
+            key = self.architect.cache.make_key(theme, mode, difficulty, self.architect.model)
+            if key == self.job_key: return
+            if key in self.pool or key in self.failed: continue
+            if self.architect.cache.peek(key) is not None: continue # Already instant
+            if i > 0 and len(self.pool) >= self.pool_size: return
+            if self.job:
+                # Typed text outranks a speculative recent theme
+                if i == 0 and typed_ready: self.cancel()
+                else: return
+            self.job_key = key
+            self.job = self.architect.generate_level_async(theme, mode, difficulty)
             return
-        try:
-            response = requests.get("http://localhost:11434/api/tags", timeout=2)
-            if response.status_code == 200:
-                data = response.json()
-                self.available_models = [m['name'] for m in data.get('models', [])]
-                if self.available_models and self.model not in self.available_models:
-                    self.model = self.available_models[0]
-        except:
-            self.available_models = ["mistral", "gemma3"] # Fallbacks
-
-    def generate_level(self, theme, mode, difficulty):
-        diff_settings = {
-            "CHILL": {"bpm": "80-100", "speed": "4-6", "desc": "Relaxed and atmospheric"},
-            "FLOW": {"bpm": "100-130", "speed": "6-8", "desc": "Steady and rhythmic"},
-            "NEURAL": {"bpm": "130-160", "speed": "8-10", "desc": "Fast and intense"},
-            "OVERLOAD": {"bpm": "160-200", "speed": "10-14", "desc": "Extreme speed and complexity"}
-        }
-        ds = diff_settings.get(difficulty, diff_settings["FLOW"])
-
-        default_level = {
-            "palette": {"bg": [20, 20, 30], "lane": [50, 50, 50], "note": [0, 255, 255], "hit": [255, 255, 255]},
-            "speed": 8,
-            "bpm": 120,
-            "name": "Offline Protocol",
-            "introtext": "CRITICAL ERROR: Connection to the main neural network has been severed. Defaulting to local rhythm protocols.",
-            "flavor_text": "Local simulation active."
-        }
-
-        if not self.online:
-            return default_level
 
-        mode_desc = {
-            "2K": "2 vertical lanes (Left, Right)",
-            "4K": "4 vertical lanes (D, F, J, K)",
-            "OSU": "Random circle positions on screen (x: 0-800, y: 0-600)"
+    def take(self, theme, mode, difficulty):
+        # Returns (level_data, None) on a pool hit, (None, job) if that exact
+        # level is still being prefetched, (None, None) otherwise.
+        key = self.architect.cache.make_key(theme, mode, difficulty, self.architect.model)
+        if key in self.pool:
+            self.hits += 1
+            return self.pool.pop(key), None
+        self.misses += 1
+        if self.job and key == self.job_key:
+            job = self.job
+            self.job = None
+            self.job_key = None
+            return None, job
+        self.cancel()
+        return None, None
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "ready": len(self.pool),
+            "pending": 1 if self.job else 0,
         }
 
-        prompt = f"""
-        You are a music engine. Create a JSON config for a rhythm game level.
-        Theme: '{theme}'
-        Game Mode: '{mode}' ({mode_desc.get(mode)})
-        Difficulty: '{difficulty}' ({ds['desc']})
-
-        Rules:
-        1. 'speed': integer {ds['speed']}. (For OSU, this is circle shrink speed, do not make too much notes appear at a time in osu mode).
-        2. 'bpm': integer {ds['bpm']}.
-        3. 'palette': RGB colors for bg, lane, note, hit.
-        4. 'introtext': A cinematic introduction to this specific world (2-3 sentences).
-        5. 'flavor_text': A short atmospheric description.
-
-        Output ONLY raw JSON:
-        {{
-            "palette": {{ "bg": [r,g,b], "lane": [r,g,b], "note": [r,g,b], "hit": [r,g,b] }},
-            "speed": 8,
-            "bpm": 128,
-            "name": "World Name",
-            "introtext": "Description...",
-            "flavor_text": "Flavor..."
-        }}
-        """
-        try:
-            print(f"Requesting '{theme}' universe from Ollama ({self.model})...")
-            
-            payload = {
-                "model": self.model,
-                "prompt": prompt,
-                "stream": False,
-                "format": "json"
-            }
-            
-            response = requests.post(self.url, json=payload, timeout=60)
-            response.raise_for_status()
-            
-            result = response.json()
-            raw_text = result.get("response", "")
-            
-            # JSON cleaning
-            start = raw_text.find('{')
-            end = raw_text.rfind('}') + 1
-            if start != -1 and end != -1:
-                raw_text = raw_text[start:end]
-            
-            level_data = json.loads(raw_text)
-            print(f"Universe synchronized: {level_data.get('name', 'Untitled')}")
-            return level_data
-        except Exception as e:
-            print(f"Ollama generation failed: {e}")
-            return default_level
-
 # --- GAME ENGINE ---
 class RhythmGame:
-    def __init__(self):
-        pygame.init()
+    def __init__(self, render_size=None, dynamic_resolution=False):
+        self.startup = StartupTimer(STARTUP_ORIGIN)
+        self.startup.mark("imports")
+        # Only the display and font modules; the mixer starts with the first
+        # custom track (play_music). The title font and level generation are
+        # set up in finish_startup, after the first frame.
+        pygame.display.init()
+        pygame.font.init()
+        self.startup.mark("pygame init")
         global WIDTH, HEIGHT
-        self.screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.RESIZABLE)
+        if render_size: WIDTH, HEIGHT = render_size
+        self.display = pygame.display.set_mode((WIDTH, HEIGHT), pygame.RESIZABLE)
         pygame.display.set_caption("NEURALFLOW: AI Rhythm")
-        self.clock = pygame.time.Clock()
-        self.font = pygame.font.SysFont("Consolas", 24)
-        self.big_font = pygame.font.SysFont("Consolas", 72, bold=True)
-        self.title_font = pygame.font.SysFont("Consolas", 100, bold=True)
+        self.startup.mark("window")
+        self.surface = self.display # Render target: the window itself while it matches the render size
+        self.canvas = new_surface((WIDTH, HEIGHT)) # Offscreen target while shaking
+        self.screen = self.surface # Where draw_* methods render this frame
+        # Picks the render scale from GAME frame times; None = fixed size
+        self.resolution = ResolutionController((WIDTH, HEIGHT)) if dynamic_resolution else None
+        self.render_scale = 1.0 # Backing surface size / layout size; below 1 only during runs
+        self.scaled_fonts = {} # render scale -> (font, big_font, title_font)
+        self.show_debug = False
+        self.debug_font = None
+        self.debug_lines = []
+        self.profiler = FrameProfiler()
+        self.clock = pygame.time.Clock() # Only measures the frame rate now
+        self.game_clock = GameClock()
+        self.visual_time = 0.0
+        self.target_fps = FPS
+        self.fonts = FontResolver()
+        self.font = self.fonts.font("Consolas", 24)
+        self.big_font = self.fonts.font("Consolas", 72, bold=True)
+        self.title_font = None # Not on the warning screen; see finish_startup
+        self.startup.mark("fonts")
+        self.text_cache = TextCache()
+        self.layers = LayerCache()
+        self.presenter = DirtyPresenter()
+        self.menu_particles = [] # Background ambiance
+        self.spawn_menu_particles()
         
-        self.architect = LevelArchitect()
+        self.architect = None # Level generation, set up in finish_startup
+        self.prefetcher = None
+        self.startup_pending = True
+        self.startup_report = False # Print the phase breakdown once startup is done
         
-        self.notes = [] 
-        self.particles = []
-        self.menu_particles = [] # Background ambiance
-        for _ in range(50):
-            self.menu_particles.append([random.randint(0, WIDTH), random.randint(0, HEIGHT), random.uniform(0.5, 2)])
+        self.sim = None # Gameplay state for the current run (see simulation.py)
+        self.particles = ParticlePool()
 
-        self.score = 0
-        self.combo = 0
-        self.hp = 100
-        self.max_hp = 100
         self.running = True
         self.state = "EPILEPSY" # EPILEPSY, TITLE, MENU, INPUT, LOADING, INTRO, COUNTDOWN, GAME, SETTINGS, DEATH
         
@@ -187,290 +235,452 @@ class RhythmGame:
         # Level & Rhythmic State
         self.current_theme = ""
         self.level_data = None
+        self.generation_job = None
+        self.analysis_job = None # Custom music being analyzed before generation starts
+        self.music = None # Beat analysis of the custom track for this run, if any
         self.input_text = ""
-        self.start_time = 0
-        self.last_beat_spawned = -1
-        self.bpm = 120
-        self.beat_interval = 60 / self.bpm
+        self.startup.mark("game state")
+
+    def finish_startup(self):
+        # Work the epilepsy warning doesn't need, run once its first frame is
+        # on screen. The warning can't be dismissed before this has run.
+        if not self.startup_pending: return
+        self.startup_pending = False
+        self.title_font = self.fonts.font("Consolas", 100, bold=True)
+        from architect import LevelArchitect # Pulls in requests, the slowest import left
+        self.architect = LevelArchitect()
+        self.prefetcher = LevelPrefetcher(self.architect)
+        self.startup.mark("level generation")
+        if self.startup_report:
+            print(f"Startup (fonts: {self.fonts.hits} cached, {self.fonts.misses} resolved):\n{self.startup.report()}")
+
+    def begin_intro(self, level_data):
+        self.level_data = level_data
+        self.intro_timer = pygame.time.get_ticks()
+        self.state = "INTRO"
+
+    def is_palette_ready(self, palette):
+        return is_valid_palette(palette)
+
+    def play_music(self):
+        # Chart times are seconds into the track, so playback starts with the run
+        try:
+            if not pygame.mixer.get_init(): pygame.mixer.init()
+            pygame.mixer.music.load(self.music["path"])
+            pygame.mixer.music.play(loops=-1)
+        except pygame.error as e:
+            print(f"Music playback failed: {e}")
+
+    def finish_run(self, background=True):
+        # Close out the run's replay and write it; the write happens off the
+        # main thread so ending a run never stalls a frame
+        sim = self.sim
+        if not sim or not sim.recorder or self.state != "GAME": return
+        now = self.game_time()
+        sim.update(now)
+        replay = sim.recorder.replay(sim, now - sim.start_time)
+        sim.recorder = None
+        if background: threading.Thread(target=save_replay, args=(replay,), daemon=True).start()
+        else: save_replay(replay)
+
+    def stop_music(self):
+        if self.music and pygame.mixer.get_init():
+            pygame.mixer.music.stop()
 
     def trigger_shake(self, intensity=5, duration=10):
         self.shake_intensity = intensity
         self.shake_timer = duration
 
-    def spawn_note(self, current_time):
-        elapsed = current_time - self.start_time
-        target_beat = int(elapsed / self.beat_interval) + 2 
-        
-        if target_beat > self.last_beat_spawned:
-            target_time = self.start_time + (target_beat * self.beat_interval)
-            
-            if self.active_mode == "2K":
-                lane = random.choice([0, 1])
-                x = WIDTH * 0.35 if lane == 0 else WIDTH * 0.65
-                self.notes.append({"x": x, "y": 0, "lane": lane, "active": True, "target_time": target_time})
-            elif self.active_mode == "4K":
-                lane = random.choice([0, 1, 2, 3])
-                x = WIDTH * (0.2 + lane * 0.2)
-                self.notes.append({"x": x, "y": 0, "lane": lane, "active": True, "target_time": target_time})
-            elif self.active_mode == "OSU":
-                x = random.randint(100, WIDTH - 100)
-                y = random.randint(150, HEIGHT - 150)
-                self.notes.append({"x": x, "y": y, "active": True, "target_time": target_time})
-                
-            self.last_beat_spawned = target_beat
-
-    def create_particles(self, x, y, color):
-        for _ in range(10):
-            self.particles.append({
-                "x": x, "y": y,
-                "vx": random.uniform(-5, 5), "vy": random.uniform(-5, 5),
-                "life": 20, "color": color
-            })
-
-    def check_hit(self, lane=None, is_osu=False):
-        current_time = pygame.time.get_ticks() / 1000.0
-        hit_tolerance = 0.2
-        hit_made = False
-        
-        for note in self.notes:
-            if not note['active']: continue
-            
-            valid_input = False
-            if is_osu:
-                mouse_pos = pygame.mouse.get_pos()
-                dist_px = math.sqrt((mouse_pos[0]-note['x'])**2 + (mouse_pos[1]-note['y'])**2)
-                if dist_px < 50: valid_input = True
-            else:
-                if note['lane'] == lane: valid_input = True
-                
-            if valid_input:
-                dist = abs(current_time - note['target_time'])
-                if dist < hit_tolerance:
-                    note['active'] = False
-                    
-                    if dist < 0.05: self.judgment, self.judgment_color, self.score = "PERFECT", (0, 255, 255), self.score + 200 + (self.combo * 20)
-                    elif dist < 0.10: self.judgment, self.judgment_color, self.score = "GREAT", (0, 255, 100), self.score + 100 + (self.combo * 10)
-                    else: self.judgment, self.judgment_color, self.score = "GOOD", (255, 255, 100), self.score + 50 + (self.combo * 5)
-                        
-                    self.combo += 1
-                    self.judgment_timer = 30
-                    self.create_particles(note['x'], note.get('y', HEIGHT - 120), self.level_data['palette']['hit'])
-                    hit_made = True
-                    break
-        
-        if not hit_made and not is_osu: # Osu misses are handled in update
-            self.combo = 0
-            self.hp -= 2
-            self.judgment, self.judgment_color, self.judgment_timer = "MISS", (255, 50, 50), 20
+    def game_time(self):
+        return self.game_clock()
+
+    def visual_ticks(self):
+        # Whole VISUAL_HZ ticks elapsed since the last call, capped after a stall
+        now = self.game_clock()
+        ticks = int((now - self.visual_time) * VISUAL_HZ)
+        self.visual_time += ticks / VISUAL_HZ
+        if ticks > 5:
+            self.visual_time = now
+            ticks = 5
+        return ticks
+
+    def tick_visuals(self):
+        if self.shake_timer > 0:
+            self.shake_timer -= 1
+        else:
+            self.shake_intensity = 0
+        if self.judgment_timer > 0: self.judgment_timer -= 1
+        if self.state == "GAME": self.particles.update()
+        for p in self.menu_particles:
+            p[1] += p[2]
+            if p[1] > HEIGHT: p[1] = 0
 
     def run(self):
+        self.set_profiling(bool(os.environ.get("NEURALFLOW_PROFILE")))
+        next_frame = self.game_clock()
         while self.running:
-            dt = self.clock.tick(FPS)
+            # Input and gameplay run at INPUT_HZ; frames are drawn at target_fps (0 = uncapped)
+            now = self.game_clock()
+            if self.target_fps and now < next_frame:
+                self.poll_input()
+                if self.state == "GAME" and self.sim: self.sim.update()
+                time.sleep(min(next_frame - now, 1.0 / INPUT_HZ))
+                continue
+            if self.target_fps:
+                next_frame = max(next_frame + 1.0 / self.target_fps, now)
+            self.frame()
+        self.finish_run(background=False)
+        if os.environ.get("NEURALFLOW_PROFILE"):
+            self.export_profile()
+        if self.startup_report:
+            print(f"Startup: {self.startup.summary()}")
+        # Closed before the first frame finished: nothing was set up to save
+        if self.architect:
+            self.architect.cache.flush()
+            self.architect.model_stats.flush()
+        if os.environ.get("NEURALFLOW_PROFILE") or self.startup_report:
+            # Debugging counters, only when profiling was asked for
+            if self.architect:
+                print(f"Level cache: {self.architect.cache.stats()}")
+                print(f"Prefetch pool: {self.prefetcher.stats()}")
+            print(f"Text cache: {self.text_cache.stats()}")
+            print(f"Surface allocations: {ALLOCS.total} total, peak {ALLOCS.peak} in one frame")
+            print(f"Presented frames: {self.presenter.full_frames} full, {self.presenter.partial_frames} dirty-rect")
+            if self.resolution: print(f"Render scale: {self.resolution.scale():.0%} after {self.resolution.changes} dynamic resolution changes")
+        if self.prefetcher: self.prefetcher.cancel()
+        pygame.quit()
+
+    def spawn_menu_particles(self):
+        self.menu_particles = [[random.randint(0, WIDTH), random.randint(0, HEIGHT), random.uniform(0.5, 2)] for _ in range(50)]
+
+    def resize(self, w, h):
+        # Only the window changes; the game keeps rendering at WIDTH x HEIGHT
+        self.display = pygame.display.set_mode((w, h), pygame.RESIZABLE)
+        self.update_render_target()
+
+    def set_render_size(self, w, h):
+        # Layout follows WIDTH/HEIGHT, so this is only safe outside a run
+        # (the simulation keeps the playfield it was created with)
+        global WIDTH, HEIGHT
+        WIDTH, HEIGHT = w, h
+        self.render_scale = 1.0
+        if self.resolution: self.resolution = ResolutionController((WIDTH, HEIGHT))
+        self.canvas = new_surface((WIDTH, HEIGHT))
+        self.layers.clear()
+        self.spawn_menu_particles()
+        self.update_render_target()
+
+    def set_render_scale(self, scale):
+        # Dynamic resolution: runs are drawn into a smaller backing surface with
+        # offsets and fonts scaled to match. WIDTH x HEIGHT stays the layout
+        # size, and the simulation keeps working in layout coordinates.
+        self.render_scale = scale
+        self.canvas = new_surface(self.backing_size())
+        self.update_render_target()
+
+    def backing_size(self):
+        return round(WIDTH * self.render_scale), round(HEIGHT * self.render_scale)
+
+    def scaled_font_set(self):
+        # font, big_font and title_font at the current render scale
+        s = self.render_scale
+        if s == 1.0: return self.font, self.big_font, self.title_font
+        if s not in self.scaled_fonts:
+            self.scaled_fonts[s] = (self.fonts.font("Consolas", round(24 * s)),
+                                    self.fonts.font("Consolas", round(72 * s), bold=True),
+                                    self.fonts.font("Consolas", round(100 * s), bold=True))
+        return self.scaled_fonts[s]
+
+    def update_render_target(self):
+        size = self.backing_size()
+        if self.display.get_size() == size:
+            self.surface = self.display
+            self.presenter.set_source(None)
+        else:
+            self.surface = new_surface(size)
+            self.presenter.set_source(self.surface)
+
+    def window_to_render(self, pos):
+        # Window pixel -> layout coordinates
+        x, y = self.presenter.to_source(pos)
+        return x / self.render_scale, y / self.render_scale
+
+    def frame(self):
+        # One iteration of the main loop: input, state update, draw, present
+        self.profiler.frame_start(self.state)
+        started = time.perf_counter()
+        # Runs are drawn at the dynamic resolution's current scale, everything else at full size
+        scale = self.resolution.scale() if self.resolution and self.state in ("COUNTDOWN", "GAME") else 1.0
+        if scale != self.render_scale: self.set_render_scale(scale)
+        self.clock.tick()
+
+        # Shake, judgment and particle timers count VISUAL_HZ ticks, so they
+        # run at the same speed whatever the frame rate
+        for _ in range(self.visual_ticks()):
+            self.tick_visuals()
+
+        # --- INPUT HANDLING ---
+        self.profiler.begin("events")
+        self.poll_input()
+        self.profiler.end()
+
+        # --- LOGIC UPDATES ---
+        frame_state = self.state
+        # While shaking, draw offscreen and blit the whole frame at an offset
+        shaking = self.shake_timer > 0
+        self.screen = self.canvas if shaking else self.surface
+        if self.state in ("MENU", "SETTINGS", "INPUT"):
+            self.prefetcher.update(self.active_mode, self.active_difficulty, self.input_text if self.state == "INPUT" else "")
+
+        if self.state == "EPILEPSY":
+            self.draw_epilepsy_warning()
+        elif self.state == "TITLE":
+            self.draw_title()
+        elif self.state == "MENU":
+            self.draw_menu()
+        elif self.state == "SETTINGS":
+            self.draw_settings()
+        elif self.state == "INPUT":
+            self.draw_input()
+        elif self.state == "LOADING":
+            self.draw_loading()
+            # Poll the background job; the window keeps rendering meanwhile.
+            # The intro can start as soon as name and palette have streamed in.
+            if self.analysis_job and self.analysis_job.done():
+                try:
+                    # The cache is keyed by content, so the path comes from this job
+                    self.music = {**self.analysis_job.result(), "path": self.analysis_job.path}
+                    print(f"Analyzed {self.music['file']}: {self.music['tempo']:.1f} BPM, {len(self.music['beats'])} beats")
+                except Exception as e:
+                    print(f"Audio analysis failed: {e}")
+                    self.music = None
+                self.analysis_job = None
+                self.generation_job = self.architect.generate_level_async(self.current_theme, self.active_mode, self.active_difficulty)
+            job = self.generation_job
+            if job and (job.done() or (job.has_fields("name", "palette") and self.is_palette_ready(job.partial["palette"]))):
+                self.begin_intro(job.partial)
+        
+        elif self.state == "INTRO":
+            if self.generation_job and self.generation_job.done():
+                self.level_data = self.generation_job.result()
+                self.generation_job = None
+            self.draw_intro()
+            if not self.generation_job and pygame.time.get_ticks() - self.intro_timer > 4000: # 4 seconds of intro
+                chart = chart_for_level(self.level_data, self.active_mode, self.music)
+                if self.music: self.level_data = {**self.level_data, "bpm": chart.bpm}
+                self.sim = RhythmSim(self.active_mode, self.level_data, WIDTH, HEIGHT, self.user_speed, clock=self.game_time, chart=chart,
+                                     recorder=ReplayRecorder())
+                self.profiler.instrument(self.sim, PROFILED_SIM_METHODS)
+                self.intro_timer = pygame.time.get_ticks()
+                self.state = "COUNTDOWN"
+
+        elif self.state == "COUNTDOWN":
+            self.draw_countdown()
+            elapsed = pygame.time.get_ticks() - self.intro_timer
+            self.countdown_val = 3 - int(elapsed / 1000)
+            if self.countdown_val <= 0:
+                self.sim.start()
+                if self.music: self.play_music()
+                self.state = "GAME"
+
+        elif self.state == "GAME":
+            self.update_game()
+            self.draw_game()
             
-            # --- SHAKE TIMER UPDATE (Global) ---
-            if self.shake_timer > 0:
-                self.shake_timer -= 1
-            else:
-                self.shake_intensity = 0
+        elif self.state == "DEATH":
+            self.draw_death()
+
+        # Final composition with shake
+        if shaking:
+            self.profiler.begin("shake")
+            shake_x = random.randint(-self.shake_intensity, self.shake_intensity)
+            shake_y = random.randint(-self.shake_intensity, self.shake_intensity)
+            self.surface.fill((0, 0, 0))
+            self.surface.blit(self.canvas, (shake_x, shake_y))
+            self.profiler.end()
+
+        if self.show_debug:
+            self.draw_debug_overlay()
+
+        # Only GAME tracks its dirty regions; everything else is a full flip
+        self.profiler.begin("present")
+        self.presenter.present(full=shaking or frame_state != "GAME" or self.state != frame_state)
+        self.profiler.end()
+        self.profiler.frame_end()
+        ALLOCS.end_frame()
+        # Only runs count: menus are cheap, and the size can't change mid-run anyway
+        if self.resolution and frame_state == "GAME":
+            self.resolution.record(time.perf_counter() - started, 1.0 / (self.target_fps or FPS))
+        if self.startup_pending:
+            self.startup.mark_first_pixel()
+            if self.running: self.finish_startup() # Not for a window closed right away
+
+    def poll_input(self):
+        # Every event is stamped with the game clock when it is pumped; with
+        # run() polling at INPUT_HZ that is within a millisecond of arrival,
+        # independent of the frame rate.
+        events = pygame.event.get()
+        now = self.game_clock()
+        for event in events:
+            if event.type == pygame.QUIT:
+                self.running = False
+            
+            if event.type == pygame.WINDOWEXPOSED:
+                self.presenter.invalidate()
 
-            # --- INPUT HANDLING ---
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.running = False
-                
-                if event.type == pygame.VIDEORESIZE:
-                    global WIDTH, HEIGHT
-                    WIDTH, HEIGHT = event.w, event.h
-                    self.screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.RESIZABLE)
-                    self.menu_particles = []
-                    for _ in range(50):
-                        self.menu_particles.append([random.randint(0, WIDTH), random.randint(0, HEIGHT), random.uniform(0.5, 2)])
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                self.show_debug = not self.show_debug
+                self.set_profiling(self.show_debug or bool(os.environ.get("NEURALFLOW_PROFILE")))
+                self.presenter.invalidate()
+
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F5 and self.profiler.enabled:
+                self.export_profile()
+
+            if event.type == pygame.VIDEORESIZE:
+                self.resize(event.w, event.h)
+
+            elif self.state == "EPILEPSY":
+                # Presses queued before the first frame would reach the menus
+                # ahead of the title font, architect and prefetcher
+                if event.type in [pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN] and not self.startup_pending:
+                    self.state = "TITLE"
+                    self.trigger_shake(8, 15) # 0.25s
+
+            elif self.state == "TITLE":
+                if event.type in [pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN]:
                     self.state = "MENU"
-                    self.trigger_shake(5, 30)
+                    self.trigger_shake(5, 15)
 
-                elif self.state == "EPILEPSY":
-                    if event.type in [pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN]:
-                        self.state = "TITLE"
-                        self.trigger_shake(8, 15) # 0.25s
+            elif self.state == "MENU":
+                if event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_UP:
+                        self.selected_option = (self.selected_option - 1) % len(self.menu_options)
+                        self.trigger_shake(2, 15)
+                    elif event.key == pygame.K_DOWN:
+                        self.selected_option = (self.selected_option + 1) % len(self.menu_options)
+                        self.trigger_shake(2, 15)
+                    elif event.key == pygame.K_RETURN:
+                        self.trigger_shake(8, 15)
+                        if self.selected_option == 0: self.state = "INPUT"
+                        elif self.selected_option == 1: self.state = "SETTINGS"
+                        elif self.selected_option == 2: self.running = False
 
-                elif self.state == "TITLE":
-                    if event.type in [pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN]:
-                        self.state = "MENU"
-                        self.trigger_shake(5, 15)
-
-                elif self.state == "MENU":
-                    if event.type == pygame.KEYDOWN:
-                        if event.key == pygame.K_UP:
-                            self.selected_option = (self.selected_option - 1) % len(self.menu_options)
-                            self.trigger_shake(2, 15)
-                        elif event.key == pygame.K_DOWN:
-                            self.selected_option = (self.selected_option + 1) % len(self.menu_options)
-                            self.trigger_shake(2, 15)
-                        elif event.key == pygame.K_RETURN:
-                            self.trigger_shake(8, 15)
-                            if self.selected_option == 0: self.state = "INPUT"
-                            elif self.selected_option == 1: self.state = "SETTINGS"
-                            elif self.selected_option == 2: self.running = False
-
-                elif self.state == "INPUT":
-                    if event.type == pygame.KEYDOWN:
-                        if event.key == pygame.K_RETURN and self.input_text:
-                            self.trigger_shake(10, 15)
-                            self.current_theme = self.input_text
+            elif self.state == "INPUT":
+                if event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_RETURN and self.input_text:
+                        self.trigger_shake(10, 15)
+                        self.current_theme = self.input_text
+                        self.music = None
+                        track = self.input_text.strip().strip("'\"")
+                        if is_audio_file(track):
+                            # Custom music: analyze the track first, then ask for a level themed on its name
+                            self.current_theme = os.path.splitext(os.path.basename(track))[0]
+                            self.prefetcher.cancel()
+                            self.analysis_job = AnalysisJob(track)
                             self.state = "LOADING"
-                        elif event.key == pygame.K_ESCAPE:
-                            self.trigger_shake(3, 15)
-                            self.state = "MENU"
-                        elif event.key == pygame.K_BACKSPACE:
-                            self.input_text = self.input_text[:-1]
+                            continue
+                        regenerate = bool(event.mod & pygame.KMOD_SHIFT) # SHIFT+ENTER skips the level cache
+                        self.prefetcher.remember_theme(self.current_theme)
+                        level, job = (None, None) if regenerate else self.prefetcher.take(self.current_theme, self.active_mode, self.active_difficulty)
+                        self.prefetcher.cancel()
+                        if level:
+                            self.begin_intro(level) # Prefetched: no LOADING at all
                         else:
-                            self.input_text += event.unicode
-
-                elif self.state == "SETTINGS":
-                    if event.type == pygame.KEYDOWN:
-                        if event.key == pygame.K_ESCAPE: 
-                            self.trigger_shake(3, 8)
-                            self.state = "MENU"
-                        if event.key == pygame.K_1: 
-                            self.trigger_shake(4, 10)
-                            if self.architect.available_models:
-                                self.model_index = (self.model_index + 1) % len(self.architect.available_models)
-                                self.architect.model = self.architect.available_models[self.model_index]
-                        if event.key == pygame.K_m: 
-                            self.trigger_shake(4, 10)
-                            self.mode_index = (self.mode_index + 1) % len(self.modes)
-                            self.active_mode = self.modes[self.mode_index]
-                        if event.key == pygame.K_s:
-                            self.trigger_shake(4, 10)
-                            self.user_speed = (self.user_speed % 12) + 1 # Cycle 1-12
-                        if event.key == pygame.K_d:
-                            self.trigger_shake(4, 10)
-                            self.difficulty_index = (self.difficulty_index + 1) % len(self.difficulties)
-                            self.active_difficulty = self.difficulties[self.difficulty_index]
-
-                elif self.state == "DEATH":
-                    if event.type == pygame.KEYDOWN:
-                        self.trigger_shake(12, 15)
+                            self.generation_job = job or self.architect.generate_level_async(self.current_theme, self.active_mode, self.active_difficulty, not regenerate)
+                            self.state = "LOADING"
+                    elif event.key == pygame.K_ESCAPE:
+                        self.trigger_shake(3, 15)
                         self.state = "MENU"
-                        self.score = 0
-                        self.combo = 0
-                        self.hp = 100
-
-                elif self.state == "GAME":
-                    if event.type == pygame.KEYDOWN:
-                        if self.active_mode == "2K":
-                            if event.key in [pygame.K_LEFT, pygame.K_a]: self.left_pressed = True; self.check_hit(0)
-                            if event.key in [pygame.K_RIGHT, pygame.K_d]: self.right_pressed = True; self.check_hit(1)
-                        elif self.active_mode == "4K":
-                            for i, k in enumerate(self.lane_keys):
-                                if event.key == k: self.lane_pressed[i] = True; self.check_hit(i)
-                        elif self.active_mode == "OSU":
-                            if event.key in [pygame.K_z, pygame.K_x]: self.check_hit(is_osu=True)
-                    
-                    if event.type == pygame.MOUSEBUTTONDOWN and self.active_mode == "OSU":
-                        self.check_hit(is_osu=True)
-
-                    if event.type == pygame.KEYUP:
-                        if self.active_mode == "2K":
-                            if event.key in [pygame.K_LEFT, pygame.K_a]: self.left_pressed = False
-                            if event.key in [pygame.K_RIGHT, pygame.K_d]: self.right_pressed = False
-                        elif self.active_mode == "4K":
-                            for i, k in enumerate(self.lane_keys):
-                                if event.key == k: self.lane_pressed[i] = False
-
-            # --- LOGIC UPDATES ---
-            if self.state == "EPILEPSY":
-                self.draw_epilepsy_warning()
-            elif self.state == "TITLE":
-                self.draw_title()
-            elif self.state == "MENU":
-                self.draw_menu()
+                    elif event.key == pygame.K_BACKSPACE:
+                        self.input_text = self.input_text[:-1]
+                    else:
+                        self.input_text += event.unicode
+
+            elif self.state == "LOADING" or (self.state == "INTRO" and self.generation_job):
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                    self.trigger_shake(3, 15)
+                    if self.generation_job:
+                        self.generation_job.cancel()
+                        self.generation_job = None
+                    self.analysis_job = None # Its worker finishes in the background and caches the result
+                    self.state = "INPUT"
+
             elif self.state == "SETTINGS":
-                self.draw_settings()
-            elif self.state == "INPUT":
-                self.draw_input()
-            elif self.state == "LOADING":
-                self.draw_loading()
-                self.level_data = self.architect.generate_level(self.current_theme, self.active_mode, self.active_difficulty)
-                self.bpm = self.level_data.get('bpm', 120)
-                self.beat_interval = 60 / self.bpm
-                self.intro_timer = pygame.time.get_ticks()
-                self.state = "INTRO"
-            
-            elif self.state == "INTRO":
-                self.draw_intro()
-                if pygame.time.get_ticks() - self.intro_timer > 4000: # 4 seconds of intro
-                    self.intro_timer = pygame.time.get_ticks()
-                    self.state = "COUNTDOWN"
-
-            elif self.state == "COUNTDOWN":
-                self.draw_countdown()
-                elapsed = pygame.time.get_ticks() - self.intro_timer
-                self.countdown_val = 3 - int(elapsed / 1000)
-                if self.countdown_val <= 0:
-                    self.start_time = pygame.time.get_ticks() / 1000.0
-                    self.last_beat_spawned = -1
-                    self.state = "GAME"
+                if event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_ESCAPE: 
+                        self.trigger_shake(3, 8)
+                        self.state = "MENU"
+                    if event.key == pygame.K_1: 
+                        self.trigger_shake(4, 10)
+                        models = self.architect.available_models
+                        if models:
+                            # Start from the current model, which may have been picked by latency
+                            if self.architect.model in models: self.model_index = models.index(self.architect.model)
+                            self.model_index = (self.model_index + 1) % len(models)
+                            self.architect.select_model(models[self.model_index])
+                    if event.key == pygame.K_r:
+                        self.trigger_shake(4, 10)
+                        self.architect.race = not self.architect.race
+                        if self.architect.online: self.architect.sync_models()
+                    if event.key == pygame.K_m: 
+                        self.trigger_shake(4, 10)
+                        self.mode_index = (self.mode_index + 1) % len(self.modes)
+                        self.active_mode = self.modes[self.mode_index]
+                    if event.key == pygame.K_s:
+                        self.trigger_shake(4, 10)
+                        self.user_speed = (self.user_speed % 12) + 1 # Cycle 1-12
+                    if event.key == pygame.K_d:
+                        self.trigger_shake(4, 10)
+                        self.difficulty_index = (self.difficulty_index + 1) % len(self.difficulties)
+                        self.active_difficulty = self.difficulties[self.difficulty_index]
+
+            elif self.state == "DEATH":
+                if event.type == pygame.KEYDOWN:
+                    self.trigger_shake(12, 15)
+                    self.state = "MENU"
+                    self.sim = None
 
             elif self.state == "GAME":
-                self.update_game()
-                self.draw_game()
+                if event.type == pygame.KEYDOWN:
+                    if self.active_mode == "2K":
+                        if event.key in [pygame.K_LEFT, pygame.K_a]: self.left_pressed = True; self.sim.press(0, now)
+                        if event.key in [pygame.K_RIGHT, pygame.K_d]: self.right_pressed = True; self.sim.press(1, now)
+                    elif self.active_mode == "4K":
+                        for i, k in enumerate(self.lane_keys):
+                            if event.key == k: self.lane_pressed[i] = True; self.sim.press(i, now)
+                    elif self.active_mode == "OSU":
+                        if event.key in [pygame.K_z, pygame.K_x]: self.sim.click(*self.window_to_render(pygame.mouse.get_pos()), now)
                 
-            elif self.state == "DEATH":
-                self.draw_death()
+                if event.type == pygame.MOUSEBUTTONDOWN and self.active_mode == "OSU":
+                    self.sim.click(*self.window_to_render(event.pos), now)
 
-            # Final composition with shake
-            if self.shake_timer > 0:
-                shake_x = random.randint(-self.shake_intensity, self.shake_intensity)
-                shake_y = random.randint(-self.shake_intensity, self.shake_intensity)
-                temp_surface = self.screen.copy()
-                self.screen.fill((0, 0, 0))
-                self.screen.blit(temp_surface, (shake_x, shake_y))
+                if event.type == pygame.KEYUP:
+                    if self.active_mode == "2K":
+                        if event.key in [pygame.K_LEFT, pygame.K_a]: self.left_pressed = False
+                        if event.key in [pygame.K_RIGHT, pygame.K_d]: self.right_pressed = False
+                    elif self.active_mode == "4K":
+                        for i, k in enumerate(self.lane_keys):
+                            if event.key == k: self.lane_pressed[i] = False
 
-            pygame.display.flip()
-        pygame.quit()
 
     def update_game(self):
-        current_time = pygame.time.get_ticks() / 1000.0
-        self.spawn_note(current_time)
-        
-        # Use user_speed for 2K/4K, or level speed for OSU (shrink speed)
-        speed_val = self.user_speed if self.active_mode != "OSU" else self.level_data['speed']
-        speed_multiplier = speed_val * 100
-        hit_y = HEIGHT - 120
-        
-        # Update Notes
-        for note in self.notes:
-            if not note['active']: continue
-            
-            if self.active_mode != "OSU":
-                note['y'] = hit_y + (current_time - note['target_time']) * speed_multiplier
-            
-            # Miss detection
-            if current_time > note['target_time'] + (0.1 if self.active_mode == "OSU" else 0.2):
-                note['active'] = False
-                self.hp -= 10
-                self.combo = 0
-                self.judgment, self.judgment_color, self.judgment_timer = "MISS", (255, 50, 50), 20
-        
-        # Cleanup
-        self.notes = [n for n in self.notes if (n.get('y', 0) < HEIGHT + 50) or (current_time < n['target_time'] + 1)]
-
-        for p in self.particles:
-            p['x'] += p['vx']; p['y'] += p['vy']; p['life'] -= 1
-        self.particles = [p for p in self.particles if p['life'] > 0]
-
-        if self.judgment_timer > 0: self.judgment_timer -= 1
-        
-        if self.hp <= 0:
+        self.sim.update()
+        for kind, judgment, x, y in self.sim.drain_events():
+            self.judgment, self.judgment_color = judgment, JUDGMENT_COLORS[judgment]
+            self.judgment_timer = 30 if kind == "hit" else 20
+            if kind == "hit":
+                self.particles.emit(x, y, self.level_data['palette']['hit'])
+
+        if self.sim.dead:
+            self.finish_run()
             self.state = "DEATH"
-            self.notes = []
-            self.particles = []
+            self.stop_music()
+            self.particles.clear()
 
     # --- DRAWING ---
     def draw_epilepsy_warning(self):
         self.screen.fill((0, 0, 0))
-        t1 = self.big_font.render("EPILEPSY WARNING", True, (255, 50, 50))
+        t1 = self.text_cache.render(self.big_font, "EPILEPSY WARNING", (255, 50, 50))
         
         warning_lines = [
             "This game contains flashing lights, rapid patterns,",
@@ -486,27 +696,82 @@ class RhythmGame:
         
         for i, line in enumerate(warning_lines):
             color = (200, 200, 200) if "PROCEED" not in line else (0, 255, 255)
-            lt = self.font.render(line, True, color)
+            lt = self.text_cache.render(self.font, line, color)
             self.screen.blit(lt, (WIDTH//2 - lt.get_width()//2, HEIGHT//2 - 20 + i*30))
 
     def draw_background_ambiance(self):
         self.screen.fill((5, 5, 10))
         for p in self.menu_particles:
-            p[1] += p[2]
-            if p[1] > HEIGHT: p[1] = 0
             pygame.draw.circle(self.screen, (30, 30, 60), (int(p[0]), int(p[1])), 2)
         
         # Scanlines (Global)
-        for y in range(0, HEIGHT, 4):
-            pygame.draw.line(self.screen, (0, 0, 0, 30), (0, y), (WIDTH, y))
+        self.screen.blit(self.layers.get("scanlines", (WIDTH, HEIGHT), None, self.build_scanlines), (0, 0))
+
+    # --- STATIC LAYERS ---
+    def build_scanlines(self, size):
+        w, h = size
+        layer = new_surface(size)
+        layer.fill(COLORKEY)
+        for y in range(0, h, 4):
+            pygame.draw.line(layer, (0, 0, 0), (0, y), (w, y))
+        layer.set_colorkey(COLORKEY)
+        return layer
+
+    def build_lanes(self, size):
+        # Lane lines and hit rings, drawn over the background and lane glow
+        w, h = size
+        s = self.render_scale
+        p = self.level_data['palette']
+        layer = new_surface(size)
+        layer.fill(COLORKEY)
+        if self.active_mode in ["2K", "4K"]:
+            for i in range(lane_count(self.active_mode)):
+                x = lane_x(self.active_mode, i, WIDTH) * s
+                pygame.draw.line(layer, p['lane'], (x, 0), (x, h), max(1, round(2 * s)))
+                pygame.draw.circle(layer, (255, 255, 255), (int(x), round((HEIGHT - 120) * s)), round(45 * s), max(1, round(2 * s)))
+        layer.set_colorkey(COLORKEY)
+        return layer
+
+    def build_game_static(self, size):
+        # Background with the lanes on it: what every GAME pixel returns to
+        layer = new_surface(size)
+        layer.fill(self.level_data['palette']['bg'])
+        if self.active_mode in ["2K", "4K"]:
+            layer.blit(self.layers.get("lanes", size, (self.active_mode, repr(self.level_data['palette'])), self.build_lanes), (0, 0))
+        return layer
+
+    def build_hud(self, size):
+        w, h = size
+        s = self.render_scale
+        p = self.level_data['palette']
+        layer = new_surface((w, round(82 * s)))
+        layer.fill((10, 10, 20))
+        pygame.draw.line(layer, p['lane'], (0, round(80 * s)), (w, round(80 * s)), max(1, round(2 * s)))
+        pygame.draw.rect(layer, (40, 40, 60), self.scaled_rect(20, 45, 200, 15))
+        return layer
+
+    def scaled_rect(self, x, y, w, h):
+        # A layout rect on the backing surface
+        s = self.render_scale
+        return pygame.Rect(round(x * s), round(y * s), round(w * s), round(h * s))
+
+    def build_glow(self, size):
+        layer = new_surface(size, pygame.SRCALPHA)
+        layer.fill((*self.level_data['palette']['hit'], 40))
+        return layer
+
+    def build_dim_overlay(self, size):
+        layer = new_surface(size, pygame.SRCALPHA)
+        layer.fill((0, 0, 0, 150))
+        return layer
 
     def draw_title(self):
         self.draw_background_ambiance()
         t = pygame.time.get_ticks() * 0.002
         glow_val = abs(math.sin(t)) * 100 + 155
         
-        title = self.title_font.render("NEURALFLOW", True, (0, glow_val, glow_val))
-        sub = self.font.render("PRESS ANY KEY TO START", True, (150, 150, 150))
+        title = self.text_cache.render(self.title_font, "NEURALFLOW", (0, glow_val, glow_val))
+        sub = self.text_cache.render(self.font, "PRESS ANY KEY TO START", (150, 150, 150))
         
         self.screen.blit(title, (WIDTH//2 - title.get_width()//2, HEIGHT//2 - 50))
         if int(pygame.time.get_ticks() / 500) % 2 == 0:
@@ -514,7 +779,7 @@ class RhythmGame:
 
     def draw_menu(self):
         self.draw_background_ambiance()
-        title = self.big_font.render("[[LAUNCH]]", True, (255, 255, 255))
+        title = self.text_cache.render(self.big_font, "[[LAUNCH]]", (255, 255, 255))
         self.screen.blit(title, (WIDTH//2 - title.get_width()//2, 100))
 
         for i, option in enumerate(self.menu_options):
@@ -522,7 +787,7 @@ class RhythmGame:
             color = (0, 255, 255) if is_selected else (100, 100, 100)
             
             # Draw the option text centered
-            txt = self.font.render(option, True, color)
+            txt = self.text_cache.render(self.font, option, color)
             x_pos = WIDTH//2 - txt.get_width()//2
             y_pos = 300 + i * 70
             
@@ -532,35 +797,48 @@ class RhythmGame:
                 pygame.draw.rect(self.screen, (10, 30, 30), (WIDTH//2 - box_w//2, y_pos - 10, box_w, 45))
                 pygame.draw.rect(self.screen, (0, 255, 255), (WIDTH//2 - box_w//2, y_pos - 10, box_w, 45), 1)
                 # Centered prefix that doesn't shift text
-                prefix = self.font.render(">>", True, (0, 255, 255))
+                prefix = self.text_cache.render(self.font, ">>", (0, 255, 255))
                 self.screen.blit(prefix, (WIDTH//2 - box_w//2 + 20, y_pos))
 
             self.screen.blit(txt, (x_pos, y_pos))
 
     def draw_settings(self):
         self.draw_background_ambiance()
-        title = self.big_font.render("SYSTEM CONFIG", True, (200, 200, 200))
+        title = self.text_cache.render(self.big_font, "SYSTEM CONFIG", (200, 200, 200))
         self.screen.blit(title, (WIDTH//2 - title.get_width()//2, 40))
         
         curr_y = 120
         # AI Model
-        model_title = self.font.render("[AI MODEL - PRESS 1 TO CYCLE]", True, (150, 150, 150))
+        race = "ON" if self.architect.race else "OFF"
+        model_title = self.text_cache.render(self.font, f"[AI MODEL - PRESS 1 TO CYCLE, R RACE: {race}]", (150, 150, 150))
         self.screen.blit(model_title, (WIDTH//2 - model_title.get_width()//2, curr_y))
         curr_y += 35
         
-        models = self.architect.available_models if self.architect.available_models else ["Searching..."]
+        if self.architect.available_models: models = self.architect.available_models
+        elif not self.architect.probed.is_set(): models = ["Searching..."]
+        else: models = ["Ollama offline"]
+        racers = self.architect.race_models() if self.architect.race else []
         for i, mid in enumerate(models[:5]): 
             is_active = (self.architect.model == mid)
-            color = (0, 255, 150) if is_active else (80, 80, 80)
-            prefix_str = ">> " if is_active else "   "
-            txt = self.font.render(prefix_str + mid, True, color)
+            color = (0, 255, 150) if is_active else (0, 150, 100) if mid in racers else (80, 80, 80)
+            prefix_str = ">> " if is_active else " + " if mid in racers else "   "
+            txt = self.text_cache.render(self.font, prefix_str + mid, color)
             self.screen.blit(txt, (WIDTH//2 - 150, curr_y))
+            if self.architect.available_models:
+                status = self.architect.model_status(mid)
+                status_t = self.text_cache.render(self.font, status, MODEL_STATUS_COLORS[status])
+                self.screen.blit(status_t, (WIDTH//2 - 270, curr_y))
+            ms = self.architect.model_stats.stats(mid)
+            if ms["samples"] or ms["failure_rate"]:
+                p50 = f"{ms['p50']:5.1f}s" if ms["p50"] is not None else "   --"
+                lat = self.text_cache.render(self.font, f"{p50} {ms['failure_rate']:4.0%} ERR", (70, 70, 70))
+                self.screen.blit(lat, (WIDTH//2 + 170, curr_y))
             curr_y += 25
         
         curr_y += 40
 
         # Difficulty
-        diff_title = self.font.render("[DIFFICULTY - PRESS D]", True, (150, 150, 150))
+        diff_title = self.text_cache.render(self.font, "[DIFFICULTY - PRESS D]", (150, 150, 150))
         self.screen.blit(diff_title, (WIDTH//2 - diff_title.get_width()//2, curr_y))
         curr_y += 40
         
@@ -570,7 +848,7 @@ class RhythmGame:
         for i, d in enumerate(self.difficulties):
             is_active = (self.active_difficulty == d)
             color = (0, 200, 255) if is_active else (80, 80, 80)
-            txt = self.font.render(d, True, color)
+            txt = self.text_cache.render(self.font, d, color)
             x_pos = start_x + (i * diff_spacing) + (diff_spacing // 2 - txt.get_width() // 2)
             if is_active:
                 pygame.draw.rect(self.screen, color, (x_pos - 10, curr_y - 5, txt.get_width() + 20, 35), 1)
@@ -579,7 +857,7 @@ class RhythmGame:
         curr_y += 80
 
         # Game Mode
-        mode_title = self.font.render("[GAME MODE - PRESS M]", True, (150, 150, 150))
+        mode_title = self.text_cache.render(self.font, "[GAME MODE - PRESS M]", (150, 150, 150))
         self.screen.blit(mode_title, (WIDTH//2 - mode_title.get_width()//2, curr_y))
         curr_y += 40
         
@@ -589,7 +867,7 @@ class RhythmGame:
         for i, m in enumerate(self.modes):
             is_active = (self.active_mode == m)
             color = (255, 100, 255) if is_active else (80, 80, 80)
-            txt = self.font.render(m, True, color)
+            txt = self.text_cache.render(self.font, m, color)
             x_pos = start_x_m + (i * mode_spacing) + (mode_spacing // 2 - txt.get_width() // 2)
             if is_active:
                 pygame.draw.rect(self.screen, color, (x_pos - 10, curr_y - 5, txt.get_width() + 20, 35), 1)
@@ -599,21 +877,25 @@ class RhythmGame:
 
         # Scroll Speed
         if self.active_mode != "OSU":
-            speed_title = self.font.render(f"[SCROLL SPEED - PRESS S]: {self.user_speed}", True, (255, 200, 100))
+            speed_title = self.text_cache.render(self.font, f"[SCROLL SPEED - PRESS S]: {self.user_speed}", (255, 200, 100))
             self.screen.blit(speed_title, (WIDTH//2 - speed_title.get_width()//2, curr_y))
             curr_y += 35
             bar_w = 300
             pygame.draw.rect(self.screen, (40, 40, 40), (WIDTH//2 - bar_w//2, curr_y, bar_w, 15))
             pygame.draw.rect(self.screen, (255, 200, 100), (WIDTH//2 - bar_w//2, curr_y, int((self.user_speed/12) * bar_w), 15))
 
-        hint = self.font.render("ESC TO RETURN", True, (100, 100, 100))
-        self.screen.blit(hint, (WIDTH//2 - hint.get_width()//2, HEIGHT - 50))
+        hint = self.text_cache.render(self.font, "ESC TO RETURN", (100, 100, 100))
+        self.screen.blit(hint, (WIDTH//2 - hint.get_width()//2, HEIGHT - 55))
+
+        cs, ps = self.architect.cache.stats(), self.prefetcher.stats()
+        stats_t = self.text_cache.render(self.font, f"CACHE {cs['entries']} LVLS {cs['bytes'] // 1024}KB {cs['hit_rate']:.0%} HIT | POOL {ps['ready']} RDY {ps['hit_rate']:.0%} HIT", (70, 70, 70))
+        self.screen.blit(stats_t, (WIDTH//2 - stats_t.get_width()//2, HEIGHT - 28))
 
     def draw_death(self):
         self.draw_background_ambiance()
-        t = self.big_font.render("CONNECTION LOST", True, (255, 50, 50))
-        res = self.font.render(f"FINAL SCORE: {self.score}", True, (255, 255, 255))
-        hint = self.font.render("PRESS ANY KEY TO REBOOT", True, (100, 100, 100))
+        t = self.text_cache.render(self.big_font, "CONNECTION LOST", (255, 50, 50))
+        res = self.text_cache.render(self.font, f"FINAL SCORE: {self.sim.score}", (255, 255, 255))
+        hint = self.text_cache.render(self.font, "PRESS ANY KEY TO REBOOT", (100, 100, 100))
         
         self.screen.blit(t, (WIDTH//2 - t.get_width()//2, HEIGHT//2 - 50))
         self.screen.blit(res, (WIDTH//2 - res.get_width()//2, HEIGHT//2 + 50))
@@ -621,132 +903,211 @@ class RhythmGame:
 
     def draw_input(self):
         self.draw_background_ambiance()
-        sub = self.font.render("ENTER ATMOSPHERIC VIBE", True, (100, 100, 120))
+        sub = self.text_cache.render(self.font, "ENTER ATMOSPHERIC VIBE", (100, 100, 120))
         inp_box = pygame.Rect(WIDTH//2 - 200, 300, 400, 50)
         pygame.draw.rect(self.screen, (20, 20, 30), inp_box)
         pygame.draw.rect(self.screen, (0, 255, 255), inp_box, 2)
         
-        inp = self.font.render(self.input_text + ("_" if pygame.time.get_ticks() // 500 % 2 == 0 else ""), True, (255, 255, 255))
+        inp = self.text_cache.render(self.font, self.input_text + ("_" if pygame.time.get_ticks() // 500 % 2 == 0 else ""), (255, 255, 255))
         self.screen.blit(sub, (WIDTH//2 - sub.get_width()//2, 250))
         self.screen.blit(inp, (WIDTH//2 - inp.get_width()//2, 310))
 
     def draw_loading(self):
         self.screen.fill((0, 0, 0))
-        t = self.font.render("SYNCHRONIZING WITH AI...", True, (0, 255, 150))
-        pygame.draw.rect(self.screen, (0, 255, 150), (WIDTH//4, HEIGHT//2 + 40, (pygame.time.get_ticks() % 1000) / 1000 * (WIDTH//2), 5))
+        if self.analysis_job:
+            t = self.text_cache.render(self.font, f"ANALYZING {self.analysis_job.name.upper()}...", (0, 255, 150))
+            progress = self.analysis_job.progress
+        else:
+            t = self.text_cache.render(self.font, "SYNCHRONIZING WITH AI...", (0, 255, 150))
+            progress = (pygame.time.get_ticks() % 1000) / 1000
+        pygame.draw.rect(self.screen, (0, 255, 150), (WIDTH//4, HEIGHT//2 + 40, progress * (WIDTH//2), 5))
         self.screen.blit(t, (WIDTH//2 - t.get_width()//2, HEIGHT//2))
 
+        elapsed = self.generation_job.elapsed() if self.generation_job else 0
+        hint = self.text_cache.render(self.font, f"{elapsed:4.1f}s  -  ESC TO ABORT", (100, 100, 100))
+        self.screen.blit(hint, (WIDTH//2 - hint.get_width()//2, HEIGHT - 80))
+
     def draw_intro(self):
         p = self.level_data['palette']
         self.draw_background_ambiance()
         self.screen.fill(p['bg'], special_flags=pygame.BLEND_RGB_ADD)
         
-        name_t = self.big_font.render(self.level_data.get('name', 'UNKNOWN'), True, p['note'])
+        name_t = self.text_cache.render(self.big_font, self.level_data.get('name', 'UNKNOWN'), p['note'])
         self.screen.blit(name_t, (WIDTH//2 - name_t.get_width()//2, HEIGHT//4))
         
         intro_text = self.level_data.get('introtext', '')
-        # Simple word wrap for intro
-        words = intro_text.split(' ')
-        lines = []
-        current_line = ""
-        for word in words:
-            if self.font.size(current_line + word)[0] < WIDTH - 100:
-                current_line += word + " "
-            else:
-                lines.append(current_line)
-                current_line = word + " "
-        lines.append(current_line)
+        if not intro_text and self.generation_job:
+            intro_text = (self.generation_job.pending_text('introtext') or '') + "_"
+        lines = self.text_cache.wrap(self.font, intro_text, WIDTH - 100)
 
         for i, line in enumerate(lines):
-            lt = self.font.render(line, True, (200, 200, 200))
+            lt = self.text_cache.render(self.font, line, (200, 200, 200))
             self.screen.blit(lt, (WIDTH//2 - lt.get_width()//2, HEIGHT//2 + i*30))
         
-        skip_h = self.font.render("TRANSMISSION IN PROGRESS...", True, (100, 100, 100))
+        skip_h = self.text_cache.render(self.font, "TRANSMISSION IN PROGRESS...", (100, 100, 100))
         self.screen.blit(skip_h, (WIDTH//2 - skip_h.get_width()//2, HEIGHT - 80))
 
     def draw_countdown(self):
         p = self.level_data['palette']
         self.draw_game() # Draw the board underneath
-        overlay = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
-        overlay.fill((0, 0, 0, 150))
-        self.screen.blit(overlay, (0,0))
+        w, h = self.backing_size()
+        self.screen.blit(self.layers.get("dim", (w, h), None, self.build_dim_overlay), (0,0))
         
-        count_t = self.title_font.render(str(self.countdown_val), True, p['hit'])
-        self.screen.blit(count_t, (WIDTH//2 - count_t.get_width()//2, HEIGHT//2 - count_t.get_height()//2))
+        count_t = self.text_cache.render(self.scaled_font_set()[2], str(self.countdown_val), p['hit'])
+        self.screen.blit(count_t, (w//2 - count_t.get_width()//2, h//2 - count_t.get_height()//2))
 
     def draw_game(self):
+        # Static parts come from pre-rendered layers; everything dynamic is
+        # marked with the presenter so GAME frames can be pushed as dirty rects.
+        # Unless this frame is presented whole anyway (or last frame's dirty
+        # regions, merged, cover most of it), only those regions are restored
+        # from the static layer, and the overlays are re-applied only where
+        # something was drawn under them.
+        # Positions are in layout coordinates, scaled by s onto the backing
+        # surface (smaller than WIDTH x HEIGHT under dynamic resolution).
         p = self.level_data['palette']
-        self.screen.fill(p['bg'])
-        current_time = pygame.time.get_ticks() / 1000.0
+        mark = self.presenter.mark
+        layer_key = (self.active_mode, repr(p))
+        s = self.render_scale
+        w, h = self.backing_size()
+        font, big_font, _ = self.scaled_font_set()
+        restore = None if self.screen is not self.surface or self.presenter.force_full else self.presenter.restore_rects()
+        full = restore is None
+        static = self.layers.get("game_static", (w, h), layer_key, self.build_game_static)
+        if full:
+            self.screen.blit(static, (0, 0))
+        else:
+            for r in restore: self.screen.blit(static, r, r)
+        under_lanes = len(self.presenter.rects) # Rects marked from here to the lanes overlay
+        current_time = self.game_time()
 
         # Draw Dynamic Background
-        time_t = pygame.time.get_ticks() * 0.001
+        time_t = current_time
+        bar_color = [max(0, c-40) for c in p['lane']]
         for i in range(10):
-            y_pos = (abs(i * 100 + time_t * 50) % HEIGHT)
-            pygame.draw.line(self.screen, [max(0, c-40) for c in p['lane']], (0, y_pos), (WIDTH, y_pos), 1)
-
-        hit_y = HEIGHT - 120
+            y_pos = (abs(i * 100 + time_t * 50) % HEIGHT) * s
+            mark(pygame.draw.line(self.screen, bar_color, (0, y_pos), (w, y_pos), 1))
 
         if self.active_mode in ["2K", "4K"]:
-            num_lanes = 2 if self.active_mode == "2K" else 4
-            for i in range(num_lanes):
-                lane_x = WIDTH * (0.35 if self.active_mode == "2K" else 0.2) + (i * WIDTH * (0.3 if self.active_mode == "2K" else 0.2))
-                
+            for i in range(lane_count(self.active_mode)):
                 # Lane Glow
                 is_pressed = (i == 0 and self.left_pressed) or (i == 1 and self.right_pressed) if self.active_mode == "2K" else self.lane_pressed[i]
+                glow_x = round((lane_x(self.active_mode, i, WIDTH) - 50) * s)
                 if is_pressed:
-                    s = pygame.Surface((100, HEIGHT), pygame.SRCALPHA)
-                    pygame.draw.rect(s, (*p['hit'], 40), (0, 0, 100, HEIGHT))
-                    self.screen.blit(s, (lane_x - 50, 0))
-                
-                pygame.draw.line(self.screen, p['lane'], (lane_x, 0), (lane_x, HEIGHT), 2)
-                pygame.draw.circle(self.screen, (255, 255, 255, 100), (int(lane_x), hit_y), 45, 2)
-
-        # Notes
-        for note in self.notes:
-            if not note['active']: continue
-            
+                    glow = self.layers.get("glow", (round(100 * s), h), tuple(p['hit']), self.build_glow)
+                    self.screen.blit(glow, (glow_x, 0))
+                    # The lane line on top is restored with it; once released,
+                    # last frame's rect clears the strip
+                    mark(pygame.Rect(glow_x, 0, round(100 * s) + 1, h))
+
+            lanes = self.layers.get("lanes", (w, h), layer_key, self.build_lanes)
+            if full:
+                self.screen.blit(lanes, (0, 0))
+            else:
+                for r in self.presenter.rects[under_lanes:]: self.screen.blit(lanes, r, r)
+
+        # Notes; sizes scaled once per frame, this loop runs for every live note
+        screen, draw_circle = self.screen, pygame.draw.circle
+        if self.active_mode == "OSU":
+            note_r, note_w, approach_w = round(40 * s), max(1, round(3 * s)), max(1, round(2 * s))
+        else:
+            ring_color, ring_radii = (*p['note'], 50), [round((25 + i*2) * s) for i in range(1, 4)]
+            note_r, core_r = round(25 * s), round(10 * s)
+        for x, y, lane, target_time in self.sim.notes.iter_active():
+            pos = (int(x * s), int(y * s))
             if self.active_mode == "OSU":
                 # Circle shrinking logic
-                time_diff = note['target_time'] - current_time
+                time_diff = target_time - current_time
                 if time_diff > 0:
                     radius = 30 + (time_diff * 100)
-                    pygame.draw.circle(self.screen, p['note'], (int(note['x']), int(note['y'])), 40, 3)
-                    pygame.draw.circle(self.screen, p['hit'], (int(note['x']), int(note['y'])), int(radius), 2)
+                    mark(draw_circle(screen, p['note'], pos, note_r, note_w))
+                    mark(draw_circle(screen, p['hit'], pos, int(radius * s), approach_w))
             else:
                 # Vertical notes
-                for i in range(1, 4):
-                    pygame.draw.circle(self.screen, (*p['note'], 50), (int(note['x']), int(note['y'])), 25 + i*2, 1)
-                pygame.draw.circle(self.screen, p['note'], (int(note['x']), int(note['y'])), 25)
-                pygame.draw.circle(self.screen, (255, 255, 255), (int(note['x']), int(note['y'])), 10)
+                for r in ring_radii:
+                    ring = draw_circle(screen, ring_color, pos, r, 1)
+                mark(ring)
+                draw_circle(screen, p['note'], pos, note_r)
+                draw_circle(screen, (255, 255, 255), pos, core_r)
 
         # Particles
-        for part in self.particles:
-            pygame.draw.circle(self.screen, part['color'], (int(part['x']), int(part['y'])), random.randint(1, 4))
+        self.particles.draw(self.screen, self.presenter.rects, s)
 
         # Judgment
         if self.judgment_timer > 0:
-            j_surf = self.big_font.render(self.judgment, True, self.judgment_color)
+            j_surf = self.text_cache.render(big_font, self.judgment, self.judgment_color)
             j_surf.set_alpha(min(255, self.judgment_timer * 12))
-            self.screen.blit(j_surf, (WIDTH//2 - j_surf.get_width()//2, HEIGHT//2))
-
-        # UI Panel
-        pygame.draw.rect(self.screen, (10, 10, 20), (0, 0, WIDTH, 80))
-        pygame.draw.line(self.screen, p['lane'], (0, 80), (WIDTH, 80), 2)
-
-        score_t = self.font.render(f"SCORE: {self.score:06}", True, (255, 255, 255))
-        combo_t = self.big_font.render(f"{self.combo}", True, (255, 255, 255))
-        pygame.draw.rect(self.screen, (40, 40, 60), (20, 45, 200, 15))
-        pygame.draw.rect(self.screen, (0, 255, 150) if self.hp > 30 else (255, 50, 50), (20, 45, int(self.hp * 2), 15))
+            mark(self.screen.blit(j_surf, (w//2 - j_surf.get_width()//2, h//2)))
+
+        # UI Panel, over anything that moved under it
+        hud = self.layers.get("hud", (w, h), layer_key, self.build_hud)
+        if full:
+            self.screen.blit(hud, (0, 0))
+        else:
+            hud_rect = hud.get_rect()
+            for r in merge_rects([hud_rect.clip(r) for r in restore + self.presenter.rects]):
+                self.screen.blit(hud, r, r)
+
+        score_t = self.text_cache.render(font, f"SCORE: {self.sim.score:06}", (255, 255, 255))
+        combo_t = self.text_cache.render(big_font, f"{self.sim.combo}", (255, 255, 255))
+        pygame.draw.rect(self.screen, (0, 255, 150) if self.sim.hp > 30 else (255, 50, 50), self.scaled_rect(20, 45, int(self.sim.hp * 2), 15))
+        mark(self.scaled_rect(20, 45, 200, 15))
         
-        elapsed = current_time - self.start_time
-        beat_progress = (elapsed % self.beat_interval) / self.beat_interval
+        elapsed = current_time - self.sim.start_time
+        beat_progress = (elapsed % self.sim.beat_interval) / self.sim.beat_interval
         metro_color = p['note'] if beat_progress < 0.1 else (50, 50, 50)
-        pygame.draw.circle(self.screen, metro_color, (WIDTH//2, 60), 10)
-
-        name_t = self.font.render(f"{self.level_data.get('name', 'UNKNOWN')} [{self.active_mode}]", True, p['note'])
-        self.screen.blit(score_t, (20, 15)); self.screen.blit(combo_t, (WIDTH - combo_t.get_width() - 20, 5)); self.screen.blit(name_t, (WIDTH//2 - name_t.get_width()//2, 15))
+        mark(pygame.draw.circle(self.screen, metro_color, (w//2, round(60 * s)), round(10 * s)))
+
+        name_t = self.text_cache.render(font, f"{self.level_data.get('name', 'UNKNOWN')} [{self.active_mode}]", p['note'])
+        margin, top = round(20 * s), round(15 * s)
+        mark(self.screen.blit(score_t, (margin, top))); mark(self.screen.blit(combo_t, (w - combo_t.get_width() - margin, round(5 * s)))); mark(self.screen.blit(name_t, (w//2 - name_t.get_width()//2, top)))
+
+    # --- PROFILING ---
+    def set_profiling(self, enabled):
+        if enabled == self.profiler.enabled: return
+        if enabled:
+            targets = [(self, PROFILED_GAME_METHODS)]
+            if self.sim: targets.append((self.sim, PROFILED_SIM_METHODS))
+            self.profiler.enable(targets)
+        else:
+            self.profiler.disable()
+
+    def export_profile(self):
+        base = data_path("profiles", time.strftime("profile-%Y%m%d-%H%M%S"))
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        self.profiler.export_json(base + ".json")
+        self.profiler.export_csv(base + ".csv")
+        self.profiler.export_chrome_trace(base + ".trace.json")
+        print(f"Profile exported to {base}.{{json,csv,trace.json}}")
+
+    def draw_debug_overlay(self):
+        if self.debug_font is None:
+            self.debug_font = self.fonts.font("Consolas", 14)
+        # Percentiles are re-sorted twice a second, not every frame
+        if not self.debug_lines or pygame.time.get_ticks() % 500 < 17:
+            rows = sorted(self.profiler.summary(self.state).items(), key=lambda kv: -kv[1][1])
+            self.debug_lines = [f"{self.state:<10} {'p50':>7} {'p95':>7} {'p99':>7} ms"]
+            self.debug_lines += [f"{phase[:18]:<18} {p50:7.2f} {p95:7.2f} {p99:7.2f}" for (_, phase), (_, p50, p95, p99) in rows[:14]]
+            self.debug_lines.append("F5 EXPORT PROFILE")
+
+        window_w, window_h = self.display.get_size()
+        lines = self.debug_lines + [f"SURF ALLOC/FRAME {ALLOCS.frame} (PEAK {ALLOCS.peak})", f"FPS {self.clock.get_fps():.0f}",
+                                    "RENDER {}x{} -> {}x{}{}".format(*self.backing_size(), window_w, window_h, " DYN" if self.resolution else "")]
+        panel = self.layers.get("debug_panel", (330, 16 * 19 + 10), None, self.build_dim_overlay)
+        self.presenter.mark(self.surface.blit(panel, (10, 90)))
+        for i, line in enumerate(lines):
+            t = self.text_cache.render(self.debug_font, line, (255, 200, 0))
+            self.surface.blit(t, (15, 95 + i * 16))
 
 if __name__ == "__main__":
-    game = RhythmGame()
+    parser = argparse.ArgumentParser(description="NEURALFLOW: AI rhythm game.")
+    parser.add_argument("--fps", type=int, default=FPS, help="render rate, e.g. 120/144/240; 0 for uncapped")
+    parser.add_argument("--startup-report", action="store_true", help="print how long each startup phase took")
+    parser.add_argument("--render-size", type=lambda s: tuple(int(v) for v in s.lower().split("x")), default=(WIDTH, HEIGHT),
+                        metavar="WxH", help=f"internal render resolution, scaled to the window (default {WIDTH}x{HEIGHT})")
+    parser.add_argument("--dynamic-resolution", action="store_true", help="lower the render resolution when frames run over budget")
+    args = parser.parse_args()
+    game = RhythmGame(args.render_size, args.dynamic_resolution)
+    game.target_fps = max(0, args.fps)
+    game.startup_report = args.startup_report
     game.run()
\ No newline at end of file
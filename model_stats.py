@@ -0,0 +1,123 @@
+import threading
+from collections import deque
+
+from storage import data_path, atomic_write_json, read_json
+
+SAVE_DELAY = 2.0 # Seconds new results may wait before they're written, batching bursts
+
+class ModelStats:
+    # Per-model generation latency and failure counts, persisted as one JSON
+    # file so the fastest reliable model can be picked at the next launch.
+    # Only the last `window` latencies per model are kept. The file is written
+    # outside self.lock, which the settings screen takes every frame.
+    def __init__(self, path=None, window=50):
+        self.path = path or data_path("model_stats.json")
+        self.window = window
+        self.models = {} # model -> {"latencies": deque, "ok": int, "failed": int, "wins": int}
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock() # Serializes file writes
+        self.snapshots = 0 # Sequence number of the last snapshot taken
+        self.written = 0 # ... and of the last one written
+        self.dirty = False
+        self.save_timer = None
+        self._load()
+
+    def _entry(self, model):
+        entry = self.models.get(model)
+        if entry is None:
+            entry = self.models[model] = {"latencies": deque(maxlen=self.window), "ok": 0, "failed": 0, "wins": 0}
+        return entry
+
+    def _load(self):
+        data = read_json(self.path, {})
+        for model, saved in data.get("models", {}).items():
+            try:
+                entry = self._entry(model)
+                entry["latencies"].extend(float(t) for t in saved["latencies"])
+                entry["ok"], entry["failed"], entry["wins"] = int(saved["ok"]), int(saved["failed"]), int(saved.get("wins", 0))
+            except (KeyError, TypeError, ValueError):
+                self.models.pop(model, None)
+
+    def _save(self):
+        # Snapshot under the lock, write without it. A snapshot older than
+        # one already written is dropped.
+        with self.lock:
+            self.snapshots += 1
+            seq = self.snapshots
+            models = {m: {**e, "latencies": list(e["latencies"])} for m, e in self.models.items()}
+            self.dirty = False
+        with self.save_lock:
+            if seq < self.written: return
+            try:
+                atomic_write_json(self.path, {"version": 1, "models": models})
+                self.written = seq
+            except OSError as e:
+                print(f"Model stats write failed: {e}")
+
+    def _changed(self):
+        # Called with self.lock held
+        self.dirty = True
+        if self.save_timer is None:
+            self.save_timer = threading.Timer(SAVE_DELAY, self._save_later)
+            self.save_timer.daemon = True
+            self.save_timer.start()
+
+    def _save_later(self):
+        with self.lock:
+            self.save_timer = None
+            if not self.dirty: return
+        self._save()
+
+    def flush(self):
+        # Write pending results now, e.g. on exit
+        if self.dirty: self._save()
+
+    def record(self, model, latency, won=False):
+        # A valid level from `model` after `latency` seconds
+        with self.lock:
+            entry = self._entry(model)
+            entry["latencies"].append(latency)
+            entry["ok"] += 1
+            if won: entry["wins"] += 1
+            self._changed()
+
+    def record_failure(self, model):
+        # Request error, or output that didn't pass validation
+        with self.lock:
+            self._entry(model)["failed"] += 1
+            self._changed()
+
+    def p50(self, model):
+        with self.lock:
+            entry = self.models.get(model)
+            if not entry or not entry["latencies"]: return None
+            ordered = sorted(entry["latencies"])
+            return ordered[len(ordered) // 2]
+
+    def failure_rate(self, model):
+        with self.lock:
+            entry = self.models.get(model)
+            total = entry["ok"] + entry["failed"] if entry else 0
+            return entry["failed"] / total if total else 0.0
+
+    def fastest(self, models, min_samples=3, max_failure_rate=0.5):
+        # Model with the lowest p50 among those with enough successful samples
+        # and an acceptable failure rate, or None if nothing qualifies yet
+        best, best_p50 = None, None
+        for model in models:
+            with self.lock:
+                entry = self.models.get(model)
+                if not entry or len(entry["latencies"]) < min_samples: continue
+            if self.failure_rate(model) > max_failure_rate: continue
+            p50 = self.p50(model)
+            if best_p50 is None or p50 < best_p50:
+                best, best_p50 = model, p50
+        return best
+
+    def stats(self, model):
+        with self.lock:
+            entry = self.models.get(model)
+            if not entry: return {"samples": 0, "p50": None, "failure_rate": 0.0, "wins": 0}
+            samples = len(entry["latencies"])
+            wins = entry["wins"]
+        return {"samples": samples, "p50": self.p50(model), "failure_rate": self.failure_rate(model), "wins": wins}
@@ -0,0 +1,51 @@
+import numpy as np
+import pygame
+
+class ParticlePool:
+    # Fixed-capacity ring buffer of hit particles. Position, velocity, life,
+    # colour and radius live in NumPy arrays; when the ring is full the oldest
+    # particles (the ones closest to dying anyway) are overwritten.
+    def __init__(self, capacity=512, life=20, seed=None):
+        self.capacity = capacity
+        self.life_span = life
+        self.pos = np.zeros((capacity, 2), dtype=np.float32)
+        self.vel = np.zeros((capacity, 2), dtype=np.float32)
+        self.life = np.zeros(capacity, dtype=np.int16)
+        self.color = np.zeros((capacity, 3), dtype=np.uint8)
+        self.radius = np.zeros(capacity, dtype=np.int16)
+        self.head = 0
+        self.dropped = 0 # live particles overwritten because the ring was full
+        self.rng = np.random.default_rng(seed)
+
+    def emit(self, x, y, color, count=10):
+        count = min(count, self.capacity)
+        idx = (self.head + np.arange(count)) % self.capacity
+        self.head = (self.head + count) % self.capacity
+        self.dropped += int(np.count_nonzero(self.life[idx] > 0))
+        self.pos[idx] = (x, y)
+        self.vel[idx] = self.rng.uniform(-5, 5, size=(count, 2))
+        self.life[idx] = self.life_span
+        self.color[idx] = np.clip(color[:3], 0, 255)
+        self.radius[idx] = self.rng.integers(1, 5, size=count)
+
+    def update(self):
+        alive = self.life > 0
+        self.pos[alive] += self.vel[alive]
+        self.life[alive] -= 1
+
+    def clear(self):
+        self.life[:] = 0
+
+    def __len__(self):
+        return int(np.count_nonzero(self.life > 0))
+
+    def draw(self, surface, rects=None, scale=1.0):
+        # Appends the drawn areas to rects, if given. Positions are scaled by
+        # `scale` onto the surface (dynamic resolution).
+        idx = np.flatnonzero(self.life > 0)
+        if not len(idx): return
+        pos, radius = self.pos[idx], self.radius[idx]
+        if scale != 1.0: pos, radius = pos * scale, np.maximum(1, np.rint(radius * scale))
+        for (x, y), color, radius in zip(pos.astype(np.int32).tolist(), self.color[idx].tolist(), radius.astype(np.int32).tolist()):
+            rect = pygame.draw.circle(surface, color, (x, y), radius)
+            if rects is not None: rects.append(rect)
@@ -0,0 +1,132 @@
+import csv
+import json
+import time
+from collections import defaultdict, deque
+
+def percentile(sorted_values, q):
+    if not sorted_values: return 0.0
+    i = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[i]
+
+class FrameProfiler:
+    # Times named phases of each frame and keeps a rolling window of samples
+    # per (state, phase). Inline phases use begin()/end(), which return
+    # immediately while disabled; methods are timed by instrument(), which
+    # swaps in a timing wrapper only while enabled, so a disabled profiler
+    # costs nothing on those paths.
+    def __init__(self, window=600, trace_limit=50000):
+        self.enabled = False
+        self.window = window
+        self.samples = defaultdict(lambda: deque(maxlen=window)) # (state, phase) -> ms
+        self.trace = deque(maxlen=trace_limit) # Chrome trace events
+        self.state = ""
+        self.stack = []
+        self.instrumented = [] # (obj, name)
+        self.origin = time.perf_counter()
+
+    def enable(self, targets=()):
+        self.enabled = True
+        for obj, names in targets:
+            self.instrument(obj, names)
+
+    def disable(self):
+        self.enabled = False
+        self.stack.clear()
+        for obj, name in self.instrumented:
+            obj.__dict__.pop(name, None)
+        self.instrumented.clear()
+
+    def instrument(self, obj, names):
+        # Shadow bound methods with timed versions on this instance
+        if not self.enabled: return
+        for name in names:
+            if name in obj.__dict__: continue
+            method = getattr(obj, name)
+            def timed(*args, _method=method, _name=name, **kwargs):
+                self.begin(_name)
+                try:
+                    return _method(*args, **kwargs)
+                finally:
+                    self.end()
+            setattr(obj, name, timed)
+            self.instrumented.append((obj, name))
+
+    def frame_start(self, state):
+        if not self.enabled: return
+        self.state = state
+        self.begin("frame")
+
+    def frame_end(self):
+        if not self.enabled: return
+        while self.stack: self.end()
+
+    def begin(self, phase):
+        if not self.enabled: return
+        self.stack.append((phase, time.perf_counter()))
+
+    def end(self):
+        if not self.enabled or not self.stack: return
+        phase, started = self.stack.pop()
+        now = time.perf_counter()
+        self.samples[(self.state, phase)].append((now - started) * 1000.0)
+        self.trace.append({
+            "name": phase, "cat": self.state, "ph": "X", "pid": 0, "tid": 0,
+            "ts": (started - self.origin) * 1e6, "dur": (now - started) * 1e6,
+        })
+
+    def summary(self, state=None):
+        # {(state, phase): (count, p50, p95, p99)} in ms
+        result = {}
+        for key, values in list(self.samples.items()):
+            if state is not None and key[0] != state: continue
+            ordered = sorted(values)
+            result[key] = (len(ordered), percentile(ordered, 0.5), percentile(ordered, 0.95), percentile(ordered, 0.99))
+        return result
+
+    def export_json(self, path):
+        rows = [{"state": s, "phase": p, "count": c, "p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+                for (s, p), (c, p50, p95, p99) in sorted(self.summary().items())]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+    def export_csv(self, path):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["state", "phase", "count", "p50_ms", "p95_ms", "p99_ms"])
+            for (s, p), (c, p50, p95, p99) in sorted(self.summary().items()):
+                writer.writerow([s, p, c, f"{p50:.4f}", f"{p95:.4f}", f"{p99:.4f}"])
+
+    def export_chrome_trace(self, path):
+        # Load in chrome://tracing or https://ui.perfetto.dev
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": list(self.trace), "displayTimeUnit": "ms"}, f)
+
+class StartupTimer:
+    # Wall time of each startup phase, measured from `origin` (a perf_counter
+    # reading taken as early as possible, before the heavy imports)
+    def __init__(self, origin=None):
+        self.origin = origin if origin is not None else time.perf_counter()
+        self.last = self.origin
+        self.phases = [] # (name, ms)
+        self.first_pixel = None # ms from origin to the first presented frame
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, (now - self.last) * 1000.0))
+        self.last = now
+
+    def mark_first_pixel(self, phase="first frame"):
+        self.mark(phase)
+        self.first_pixel = (self.last - self.origin) * 1000.0
+
+    def total(self):
+        return (self.last - self.origin) * 1000.0
+
+    def report(self):
+        lines = [f"{phase:<24} {ms:8.1f} ms" for phase, ms in self.phases]
+        if self.first_pixel is not None: lines.append(f"{'= first pixel':<24} {self.first_pixel:8.1f} ms")
+        lines.append(f"{'= total':<24} {self.total():8.1f} ms")
+        return "\n".join(lines)
+
+    def summary(self):
+        return f"first pixel {self.first_pixel or 0:.0f} ms, " + ", ".join(f"{phase} {ms:.0f}" for phase, ms in self.phases)
@@ -0,0 +1,277 @@
+import math
+import pygame
+from collections import OrderedDict
+
+class AllocCounter:
+    # Debug counter of Surface allocations, to keep the frame loop allocation-free
+    def __init__(self):
+        self.total = 0
+        self.frame = 0
+        self.last_frame = 0
+        self.peak = 0
+
+    def add(self, count=1):
+        self.total += count
+        self.frame += count
+
+    def end_frame(self):
+        self.last_frame = self.frame
+        self.peak = max(self.peak, self.frame)
+        self.frame = 0
+
+ALLOCS = AllocCounter()
+
+def new_surface(size, flags=0):
+    # Plain surfaces match the display format so blits skip conversion
+    ALLOCS.add()
+    display = pygame.display.get_surface()
+    if flags == 0 and display is not None:
+        return pygame.Surface(size, 0, display)
+    return pygame.Surface(size, flags)
+
+class TextCache:
+    # LRU cache of rendered text surfaces keyed by (font, text, color,
+    # antialias), plus cached word-wrap layouts. Colors are rounded to ints so
+    # animated colors (title glow) still land on a bounded set of keys.
+    def __init__(self, max_entries=512, max_layouts=32):
+        self.max_entries = max_entries
+        self.max_layouts = max_layouts
+        self.surfaces = OrderedDict()
+        self.layouts = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color, antialias=True):
+        key = (font, text, tuple(int(c) for c in color), antialias)
+        surf = self.surfaces.get(key)
+        if surf is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surf
+        self.misses += 1
+        ALLOCS.add()
+        surf = font.render(text, antialias, key[2])
+        self.surfaces[key] = surf
+        if len(self.surfaces) > self.max_entries:
+            self.surfaces.popitem(last=False)
+        return surf
+
+    def wrap(self, font, text, max_width):
+        # Greedy word wrap, measured with font.size only the first time
+        key = (font, text, max_width)
+        lines = self.layouts.get(key)
+        if lines is not None:
+            self.layouts.move_to_end(key)
+            return lines
+        lines = []
+        current_line = ""
+        for word in text.split(' '):
+            if font.size(current_line + word)[0] < max_width:
+                current_line += word + " "
+            else:
+                lines.append(current_line)
+                current_line = word + " "
+        lines.append(current_line)
+        self.layouts[key] = lines
+        if len(self.layouts) > self.max_layouts:
+            self.layouts.popitem(last=False)
+        return lines
+
+    def clear(self):
+        self.surfaces.clear()
+        self.layouts.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.surfaces),
+            "layouts": len(self.layouts),
+        }
+
+class LayerCache:
+    # Pre-rendered static layers and pooled overlay surfaces, built once per
+    # (name, size, key) where key captures whatever else the layer depends on
+    # (palette, mode...). Cleared when the render size changes.
+    def __init__(self):
+        self.layers = {}
+
+    def get(self, name, size, key, builder):
+        cache_key = (name, size, key)
+        layer = self.layers.get(cache_key)
+        if layer is None:
+            # Only one variant per layer name is kept around
+            for k in [k for k in self.layers if k[0] == name]: del self.layers[k]
+            layer = builder(size)
+            self.layers[cache_key] = layer
+        return layer
+
+    def clear(self):
+        self.layers.clear()
+
+# Past this fraction of the frame, handling dirty regions one by one costs
+# more than one pass over the whole frame
+FULL_REDRAW_FRACTION = 0.5
+# Two overlapping regions are handled as their bounding box unless that is
+# this much bigger than the two together (a full-width line crossing a
+# full-height strip stays two regions)
+MERGE_SLACK = 1.25
+
+def merge_rects(rects):
+    # Unions overlapping rects where that doesn't inflate the area much;
+    # what overlap remains is just handled twice
+    merged = []
+    for rect in rects:
+        if not rect: continue
+        rect = pygame.Rect(rect)
+        grown = True
+        while grown:
+            grown = False
+            for i in rect.collidelistall(merged):
+                other = merged[i]
+                union = rect.union(other)
+                if union.w * union.h <= (rect.w * rect.h + other.w * other.h) * MERGE_SLACK:
+                    del merged[i]
+                    rect, grown = union, True
+                    break
+        merged.append(rect)
+    return merged
+
+class DirtyPresenter:
+    # Presents only the regions touched by dynamic drawing this frame and the
+    # last one. Anything that moves the whole image (shake, state changes,
+    # resizes) falls back to a full flip. When the game renders at a size
+    # other than the window's, set_source() makes it scale the render surface
+    # into the window instead (aspect kept, letterboxed), again only the
+    # dirty regions on partial frames.
+    def __init__(self):
+        self.prev_rects = []
+        self.rects = []
+        self.force_full = True
+        self.full_frames = 0
+        self.partial_frames = 0
+        self.source = None # Render surface scaled to the window, None = drawn in place
+        self.viewport = None # Where the source lands in the window
+        self.view = None # Display subsurface at viewport
+        self.scale = 1.0
+
+    def mark(self, rect):
+        if rect: self.rects.append(rect)
+        return rect
+
+    def invalidate(self):
+        self.force_full = True
+
+    def bounds(self):
+        return (self.source or pygame.display.get_surface()).get_rect()
+
+    def mostly_dirty(self, rects):
+        bounds = self.bounds()
+        return sum(r.w * r.h for r in rects) > bounds.w * bounds.h * FULL_REDRAW_FRACTION
+
+    def restore_rects(self):
+        # Last frame's dirty regions (merged), for the caller to redraw the
+        # background under; None when one full redraw is cheaper, which also
+        # makes this frame a full present
+        if self.mostly_dirty(self.prev_rects):
+            self.force_full = True
+            return None
+        return self.prev_rects
+
+    def set_source(self, source=None):
+        # Call again whenever the window or the render surface changes
+        self.source = source
+        self.force_full = True
+        if source is None: return
+        display = pygame.display.get_surface()
+        (sw, sh), (ww, wh) = source.get_size(), display.get_size()
+        self.scale = min(ww / sw, wh / sh)
+        vw, vh = max(1, round(sw * self.scale)), max(1, round(sh * self.scale))
+        self.viewport = pygame.Rect((ww - vw) // 2, (wh - vh) // 2, vw, vh)
+        display.fill((0, 0, 0)) # The bars are never drawn over again
+        self.view = display.subsurface(self.viewport)
+
+    def to_source(self, pos):
+        # Window pixel -> render surface pixel
+        if self.source is None: return pos
+        x = (pos[0] - self.viewport.x) / self.scale
+        y = (pos[1] - self.viewport.y) / self.scale
+        w, h = self.source.get_size()
+        return min(max(int(x), 0), w - 1), min(max(int(y), 0), h - 1)
+
+    def present(self, full=False):
+        # Kept merged: dense charts mark hundreds of overlapping rects
+        bounds = self.bounds()
+        current = merge_rects([bounds.clip(r) for r in self.rects])
+        if full or self.force_full:
+            if self.source is not None:
+                pygame.transform.scale(self.source, self.viewport.size, self.view)
+            pygame.display.flip()
+            self.full_frames += 1
+        else:
+            rects = merge_rects(self.prev_rects + current)
+            if self.mostly_dirty(rects):
+                if self.source is not None:
+                    pygame.transform.scale(self.source, self.viewport.size, self.view)
+                pygame.display.flip()
+            elif self.source is None:
+                pygame.display.update(rects)
+            else:
+                pygame.display.update(self.scale_rects(rects))
+            self.partial_frames += 1
+        # A full frame may have been shifted (shake), so the next one must be full too
+        self.force_full = full
+        self.prev_rects, self.rects = current, []
+
+    def scale_rects(self, rects):
+        # Scales each dirty region into the window; returns the window rects
+        s, (vw, vh) = self.scale, self.viewport.size
+        updated = []
+        for r in rects:
+            x0, y0 = int(r.x * s), int(r.y * s)
+            x1, y1 = min(vw, math.ceil(r.right * s)), min(vh, math.ceil(r.bottom * s))
+            if x1 <= x0 or y1 <= y0: continue
+            dest = pygame.Rect(x0, y0, x1 - x0, y1 - y0)
+            pygame.transform.scale(self.source.subsurface(r), dest.size, self.view.subsurface(dest))
+            updated.append(dest.move(self.viewport.topleft))
+        return updated
+
+class ResolutionController:
+    # Dynamic resolution: steps the render scale down while smoothed frame
+    # times overrun the budget and back up when there is clear headroom. A
+    # step needs `patience` frames in a row past the threshold, and stepping
+    # up needs a bigger margin than the ~1.4x cost of the next size, so it
+    # doesn't flap between two sizes.
+    def __init__(self, base_size, scales=(1.0, 0.85, 0.7, 0.55), min_height=480, high=0.9, low=0.6, patience=90):
+        self.base_size = base_size
+        # Below min_height the scaled-down text gets hard to read
+        self.scales = [s for s in scales if s == 1.0 or base_size[1] * s >= min_height]
+        self.high = high
+        self.low = low
+        self.patience = patience
+        self.level = 0
+        self.average = None # Smoothed frame time, seconds
+        self.over = 0
+        self.under = 0
+        self.changes = 0
+
+    def scale(self):
+        return self.scales[self.level]
+
+    def record(self, frame_time, budget):
+        # Feed one frame's work time; True when the scale just changed
+        self.average = frame_time if self.average is None else self.average * 0.9 + frame_time * 0.1
+        self.over = self.over + 1 if self.average > budget * self.high else 0
+        self.under = self.under + 1 if self.average < budget * self.low else 0
+        if self.over >= self.patience and self.level < len(self.scales) - 1:
+            self.level += 1
+        elif self.under >= self.patience * 2 and self.level > 0:
+            self.level -= 1
+        else:
+            return False
+        # Times measured at the old size say nothing about the new one
+        self.average, self.over, self.under = None, 0, 0
+        self.changes += 1
+        return True
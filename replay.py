@@ -0,0 +1,176 @@
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import argparse
+
+import numpy as np
+
+from chart import Chart
+from simulation import RhythmSim, ManualClock
+from storage import data_path, atomic_write_bytes
+
+# Compact run replays. A replay holds everything a run's outcome depends on:
+# the level, the exact chart that was played (and so its seed), the window
+# size and scroll speed, and the input stream with run-relative times. The
+# simulation only judges by input time, so re-running it headless on a
+# ManualClock reproduces the run far faster than real time.
+
+REPLAY_MAGIC = b"NFRP"
+REPLAY_VERSION = 2
+# magic, version, mode, width, height, scroll speed, event count, end time (seconds)
+REPLAY_HEADER = struct.Struct("<4sB3sHHHId")
+# kind is 0 for lane presses, 1 for clicks (x/y in layout coordinates, which
+# aren't whole pixels under dynamic resolution)
+EVENT_DTYPE = np.dtype([("time", "<f8"), ("kind", "u1"), ("lane", "i1"), ("x", "<f4"), ("y", "<f4")])
+# Version 1 stored clicks as whole pixels
+EVENT_DTYPES = {1: np.dtype([("time", "<f8"), ("kind", "u1"), ("lane", "i1"), ("x", "<i2"), ("y", "<i2")]),
+                2: EVENT_DTYPE}
+EVENT_KINDS = ("press", "click")
+REPLAY_STEP = 1 / 120 # Update rate when re-simulating; outcomes don't depend on it
+
+class ReplayRecorder:
+    # Appends inputs to a preallocated array that doubles when full, so
+    # recording is a few array stores per key press and nothing per frame
+    def __init__(self, capacity=4096):
+        self.events = np.zeros(capacity, dtype=EVENT_DTYPE)
+        self.count = 0
+
+    def record(self, t, kind, lane, x=0, y=0):
+        if self.count == len(self.events):
+            self.events = np.concatenate([self.events, np.zeros(len(self.events), dtype=EVENT_DTYPE)])
+        self.events[self.count] = (t, EVENT_KINDS.index(kind), lane, x, y)
+        self.count += 1
+
+    def replay(self, sim, end):
+        return Replay(sim.mode, sim.width, sim.height, sim.scroll_speed, sim.level_data, sim.chart,
+                      self.events[:self.count].copy(), end, sim.result())
+
+class Replay:
+    def __init__(self, mode, width, height, scroll_speed, level_data, chart, events, end, result=None):
+        self.mode = mode
+        self.width = width
+        self.height = height
+        self.scroll_speed = scroll_speed
+        self.level_data = level_data
+        self.chart = chart
+        self.events = events # EVENT_DTYPE array, sorted by time
+        self.end = end # Run-relative time the recording stopped
+        self.result = result # RhythmSim.result() as recorded, for verification
+
+    def to_bytes(self):
+        header = REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.mode.encode("ascii"), self.width, self.height,
+                                    self.scroll_speed, len(self.events), self.end)
+        meta = json.dumps({"level": self.level_data, "result": self.result}, separators=(",", ":")).encode("utf-8")
+        chart = self.chart.to_bytes()
+        body = struct.pack("<II", len(meta), len(chart)) + meta + chart + np.ascontiguousarray(self.events, dtype=EVENT_DTYPE).tobytes()
+        return header + zlib.compress(body, 9)
+
+    def save(self, path):
+        atomic_write_bytes(path, self.to_bytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < REPLAY_HEADER.size:
+            raise ValueError("not a replay file")
+        magic, version, mode, width, height, scroll_speed, count, end = REPLAY_HEADER.unpack(data[:REPLAY_HEADER.size])
+        if magic != REPLAY_MAGIC or version not in EVENT_DTYPES:
+            raise ValueError("not a replay file")
+        try:
+            body = zlib.decompress(data[REPLAY_HEADER.size:])
+        except zlib.error as e:
+            raise ValueError(f"corrupt replay: {e}")
+        meta_len, chart_len = struct.unpack_from("<II", body)
+        offset = 8
+        meta = json.loads(body[offset:offset + meta_len])
+        offset += meta_len
+        chart = Chart.from_bytes(body[offset:offset + chart_len])
+        offset += chart_len
+        events = np.frombuffer(body, dtype=EVENT_DTYPES[version], count=count, offset=offset)
+        if version != REPLAY_VERSION: events = events.astype(EVENT_DTYPE)
+        return cls(mode.rstrip(b"\0").decode("ascii"), width, height, scroll_speed, meta["level"], chart, events, end, meta["result"])
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+def replay_path(replay):
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return data_path("replays", f"{stamp}-{replay.mode}-{replay.result['score'] if replay.result else 0}.nfr")
+
+def save_replay(replay):
+    path = replay_path(replay)
+    try:
+        replay.save(path)
+    except OSError as e:
+        print(f"Replay save failed: {e}")
+        return None
+    return path
+
+def resimulate(replay, step=REPLAY_STEP):
+    # Feed the recorded inputs back at their own times, updating in between;
+    # returns the finished RhythmSim
+    clock = ManualClock()
+    sim = RhythmSim(replay.mode, replay.level_data, replay.width, replay.height, replay.scroll_speed,
+                    clock=clock, chart=replay.chart)
+    events = replay.events
+    times, kinds, lanes, xs, ys = (events["time"].tolist(), events["kind"].tolist(), events["lane"].tolist(),
+                                   events["x"].tolist(), events["y"].tolist())
+    i, n = 0, len(events)
+    while clock.t < replay.end and not sim.dead:
+        t_next = min(clock.t + step, replay.end)
+        while i < n and times[i] < t_next:
+            if kinds[i] == 0: sim.press(lanes[i], times[i])
+            else: sim.click(xs[i], ys[i], times[i])
+            i += 1
+        clock.t = t_next
+        sim.update()
+        sim.drain_events()
+    return sim
+
+def verify(replay, step=REPLAY_STEP):
+    # (matches, re-simulated result)
+    result = resimulate(replay, step).result()
+    return result == replay.result, result
+
+def replay_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(".nfr"): yield os.path.join(path, name)
+        else:
+            yield path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-simulate NEURALFLOW replays and check their recorded results.")
+    parser.add_argument("paths", nargs="*", help="replay files or directories (default: the replay directory)")
+    parser.add_argument("--step", type=float, default=REPLAY_STEP, help="simulation update interval (seconds)")
+    parser.add_argument("--verbose", action="store_true", help="print every replay, not just mismatches")
+    args = parser.parse_args()
+
+    if args.paths: paths = list(replay_files(args.paths))
+    else: paths = list(replay_files([data_path("replays")])) if os.path.isdir(data_path("replays")) else []
+    failures, played, elapsed = 0, 0.0, 0.0
+    for path in paths:
+        try:
+            replay = Replay.load(path)
+        except (OSError, ValueError) as e:
+            print(f"{path}: unreadable ({e})")
+            failures += 1
+            continue
+        started = time.perf_counter()
+        ok, result = verify(replay, args.step)
+        elapsed += time.perf_counter() - started
+        played += replay.end
+        if not ok:
+            failures += 1
+            print(f"{path}: MISMATCH\n  recorded  {replay.result}\n  simulated {result}")
+        elif args.verbose:
+            print(f"{path}: ok (score {result['score']}, {len(replay.events)} inputs, {replay.end:.1f}s)")
+
+    speedup = played / elapsed if elapsed else 0
+    print(f"{len(paths)} replays, {played:.0f}s of play re-simulated in {elapsed:.2f}s ({speedup:.0f}x real time), {failures} failed")
+    sys.exit(1 if failures else 0)
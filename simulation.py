@@ -0,0 +1,413 @@
+import time
+import random
+import argparse
+from collections import namedtuple, deque
+
+import numpy as np
+
+from chart import generate_chart
+
+# Gameplay rules with no pygame dependency: the clock, RNG and input stream
+# are all injected so a run can be replayed or simulated headless.
+
+HIT_WINDOW = 0.2
+PERFECT_WINDOW = 0.05
+GREAT_WINDOW = 0.10
+OSU_HIT_RADIUS = 50
+# Judgment -> (base score, bonus per combo)
+JUDGMENT_SCORES = {"PERFECT": (200, 20), "GREAT": (100, 10), "GOOD": (50, 5)}
+
+# kind is "press" (lane) or "click" (x, y)
+InputEvent = namedtuple("InputEvent", "time kind lane x y")
+
+class ManualClock:
+    # Clock that only moves when told to, for headless runs
+    def __init__(self, t=0.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+    def advance(self, dt):
+        self.t += dt
+
+class GameClock:
+    # Seconds since creation from perf_counter: monotonic, sub-millisecond,
+    # and unlike pygame's millisecond ticks fine enough for judgment windows
+    def __init__(self):
+        self.origin = time.perf_counter()
+
+    def __call__(self):
+        return time.perf_counter() - self.origin
+
+def lane_count(mode):
+    return 2 if mode == "2K" else 4
+
+def lane_x(mode, lane, width):
+    if mode == "2K":
+        return width * 0.35 if lane == 0 else width * 0.65
+    return width * (0.2 + lane * 0.2)
+
+class NoteStore:
+    # Struct-of-arrays note pool. Slots are recycled through a free list and
+    # per-frame work runs vectorized over [0, high), where high only grows to
+    # the peak number of live notes.
+    def __init__(self, capacity=64):
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.target_time = np.zeros(capacity)
+        self.lane = np.full(capacity, -1, dtype=np.int16) # -1 for OSU circles
+        self.active = np.zeros(capacity, dtype=bool) # still judgeable
+        self.alive = np.zeros(capacity, dtype=bool) # slot in use
+        self.free = list(range(capacity - 1, -1, -1))
+        self.high = 0
+        self.count = 0
+
+    def _grow(self):
+        old = len(self.x)
+        new = old * 2
+        for name in ("x", "y", "target_time", "lane", "active", "alive"):
+            arr = getattr(self, name)
+            grown = np.zeros(new, dtype=arr.dtype)
+            grown[:old] = arr
+            setattr(self, name, grown)
+        self.lane[old:] = -1
+        self.free.extend(range(new - 1, old - 1, -1))
+
+    def add(self, x, y, lane, target_time):
+        if not self.free: self._grow()
+        i = self.free.pop()
+        self.x[i], self.y[i], self.lane[i], self.target_time[i] = x, y, lane, target_time
+        self.active[i] = True
+        self.alive[i] = True
+        self.high = max(self.high, i + 1)
+        self.count += 1
+        return i
+
+    def release(self, mask):
+        # mask covers [0, high)
+        idx = np.flatnonzero(mask)
+        if not len(idx): return
+        self.alive[idx] = False
+        self.active[idx] = False
+        self.free.extend(idx[::-1].tolist())
+        self.count -= len(idx)
+
+    def clear(self):
+        self.alive[:] = False
+        self.active[:] = False
+        self.free = list(range(len(self.x) - 1, -1, -1))
+        self.high = 0
+        self.count = 0
+
+    def active_indices(self):
+        n = self.high
+        return np.flatnonzero(self.alive[:n] & self.active[:n])
+
+    def iter_active(self):
+        # (x, y, lane, target_time) tuples as plain Python numbers, for drawing
+        idx = self.active_indices()
+        return zip(self.x[idx].tolist(), self.y[idx].tolist(), self.lane[idx].tolist(), self.target_time[idx].tolist())
+
+    def __len__(self):
+        return self.count
+
+class JudgmentIndex:
+    # Lookup structure for hit judgment. 2K/4K keep one queue per lane in
+    # target time order (notes spawn in time order, so appends keep it sorted);
+    # OSU keeps a spatial hash of circle positions. Entries are (slot, target_time)
+    # and are checked against the store, since slots get recycled.
+    def __init__(self, notes, lanes, cell_size=OSU_HIT_RADIUS):
+        self.notes = notes
+        self.lanes = [deque() for _ in range(lanes)]
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def _cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def _valid(self, slot, target_time):
+        notes = self.notes
+        return notes.alive[slot] and notes.active[slot] and notes.target_time[slot] == target_time
+
+    def add(self, slot):
+        notes = self.notes
+        entry = (slot, float(notes.target_time[slot]))
+        lane = int(notes.lane[slot])
+        if lane >= 0:
+            self.lanes[lane].append(entry)
+        else:
+            self.cells.setdefault(self._cell(notes.x[slot], notes.y[slot]), []).append(entry)
+
+    def remove(self, slot):
+        # Lane queues are cleaned lazily from the head; circles are removed now
+        notes = self.notes
+        if notes.lane[slot] >= 0: return
+        key = self._cell(notes.x[slot], notes.y[slot])
+        bucket = self.cells.get(key)
+        if bucket is None: return
+        bucket[:] = [e for e in bucket if e[0] != slot]
+        if not bucket: del self.cells[key]
+
+    def clear(self):
+        for queue in self.lanes: queue.clear()
+        self.cells.clear()
+
+    def next_in_lane(self, lane, now):
+        # Earliest note in the lane that is inside the hit window, or None
+        queue = self.lanes[lane]
+        while queue and not self._valid(*queue[0]):
+            queue.popleft()
+        for slot, target_time in queue:
+            if now - target_time >= HIT_WINDOW: continue # Too late, update() will call the miss
+            if target_time - now < HIT_WINDOW and self._valid(slot, target_time): return slot
+            break # Too early, and everything behind it is later still
+        return None
+
+    def circle_at(self, x, y, now):
+        # Among circles under the cursor, the one closest in time to now
+        cx, cy = self._cell(x, y)
+        notes = self.notes
+        best, best_dist = None, HIT_WINDOW
+        for gx in (cx - 1, cx, cx + 1):
+            for gy in (cy - 1, cy, cy + 1):
+                for slot, target_time in self.cells.get((gx, gy), ()):
+                    dist = abs(now - target_time)
+                    if dist >= best_dist or not self._valid(slot, target_time): continue
+                    if (x - notes.x[slot])**2 + (y - notes.y[slot])**2 >= OSU_HIT_RADIUS**2: continue
+                    best, best_dist = slot, dist
+        return best
+
+class RhythmSim:
+    def __init__(self, mode, level_data, width=800, height=600, scroll_speed=8, seed=None, clock=None, chart=None, recorder=None):
+        self.mode = mode
+        self.level_data = level_data
+        self.width = width
+        self.height = height
+        self.hit_y = height - 120
+        self.clock = clock or GameClock()
+        self.scroll_speed = scroll_speed
+        self.recorder = recorder # Gets every input with its run-relative time (see replay.py)
+
+        # Scroll speed for 2K/4K, or level speed for OSU (shrink speed)
+        speed_val = scroll_speed if mode != "OSU" else level_data.get('speed', 8)
+        self.speed_multiplier = speed_val * 100
+        self.bpm = level_data.get('bpm', 120)
+        self.beat_interval = 60 / self.bpm
+
+        # The whole note sequence comes from the chart; seed only matters when
+        # the chart has to be generated here
+        self.chart = chart or generate_chart(mode, self.bpm, seed)
+        self.seed = self.chart.seed
+        # Notes enter the store this far ahead of their time: two beats, or
+        # long enough to scroll in from the top of the screen
+        self.lookahead = 2 * self.beat_interval
+        if mode != "OSU":
+            self.lookahead = max(self.lookahead, self.hit_y / self.speed_multiplier)
+
+        self.notes = NoteStore()
+        self.index = JudgmentIndex(self.notes, lane_count(mode))
+        self.score = 0
+        self.combo = 0
+        self.max_combo = 0
+        self.hp = 100
+        self.max_hp = 100
+        self.dead = False
+        self.counts = {"PERFECT": 0, "GREAT": 0, "GOOD": 0, "MISS": 0}
+        self.events = [] # (kind, judgment, x, y) for the renderer to pick up
+        self.start()
+
+    def start(self, now=None):
+        self.start_time = self.clock() if now is None else now
+        self.cursor = 0 # Next chart note to stream in, counting across loops
+
+    def spawn_note(self, now):
+        # Stream in every chart note inside the lookahead window, so a long
+        # frame never skips beats
+        chart = self.chart
+        count = len(chart)
+        if not count: return
+        horizon = now - self.start_time + self.lookahead
+        times, lanes, xs, ys = chart.notes["time"], chart.notes["lane"], chart.notes["x"], chart.notes["y"]
+        while True:
+            loop, i = divmod(self.cursor, count)
+            if loop and chart.loop_length <= 0: break
+            t = float(times[i]) + loop * chart.loop_length
+            if t > horizon: break
+            target_time = self.start_time + t
+            lane = int(lanes[i])
+            if lane < 0:
+                x = 100 + xs[i] / 65535 * (self.width - 200)
+                y = 150 + ys[i] / 65535 * (self.height - 300)
+                self.index.add(self.notes.add(x, y, -1, target_time))
+            else:
+                self.index.add(self.notes.add(lane_x(self.mode, lane, self.width), 0, lane, target_time))
+            self.cursor += 1
+
+    def _judge(self, i, dist):
+        if dist < PERFECT_WINDOW: judgment = "PERFECT"
+        elif dist < GREAT_WINDOW: judgment = "GREAT"
+        else: judgment = "GOOD"
+        base, bonus = JUDGMENT_SCORES[judgment]
+        self.notes.active[i] = False
+        self.score += base + self.combo * bonus
+        self.combo += 1
+        self.max_combo = max(self.max_combo, self.combo)
+        self.counts[judgment] += 1
+        self.events.append(("hit", judgment, float(self.notes.x[i]), float(self.notes.y[i])))
+
+    def _miss(self, damage, count=1):
+        self.combo = 0
+        self.hp -= damage * count
+        self.counts["MISS"] += count
+        self.events.extend([("miss", "MISS", None, None)] * count)
+
+    def press(self, lane, t=None):
+        now = self.clock() if t is None else t
+        if self.recorder: self.recorder.record(now - self.start_time, "press", lane)
+        if self.dead: return False
+        # Misses that fell due before this press count first, however long ago
+        # update() last ran, so the outcome only depends on the input stream
+        self._expire(now)
+        if self.dead: return False
+        i = self.index.next_in_lane(lane, now)
+        if i is not None:
+            self._judge(i, abs(now - self.notes.target_time[i]))
+            return True
+        self._miss(2) # Pressing on nothing breaks the combo
+        if self.hp <= 0: self._die()
+        return False
+
+    def click(self, x, y, t=None):
+        # Osu misses are handled in update
+        now = self.clock() if t is None else t
+        if self.recorder: self.recorder.record(now - self.start_time, "click", -1, x, y)
+        if self.dead: return False
+        self._expire(now)
+        if self.dead: return False
+        i = self.index.circle_at(x, y, now)
+        if i is not None:
+            self._judge(i, abs(now - self.notes.target_time[i]))
+            self.index.remove(i)
+            return True
+        return False
+
+    def handle(self, event):
+        if event.kind == "press": return self.press(event.lane, event.time)
+        if event.kind == "click": return self.click(event.x, event.y, event.time)
+        return False
+
+    def update(self, now=None):
+        if self.dead: return
+        now = self.clock() if now is None else now
+        self.spawn_note(now)
+
+        notes = self.notes
+        n = notes.high
+        live = notes.alive[:n] & notes.active[:n]
+        target_time = notes.target_time[:n]
+        y = notes.y[:n]
+
+        if self.mode != "OSU":
+            np.copyto(y, self.hit_y + (now - target_time) * self.speed_multiplier, where=live)
+
+        self._expire(now)
+        if self.dead: return
+
+        # Cleanup: every note is hit or missed by target_time + HIT_WINDOW and
+        # is no longer drawn after that, so its slot is free a second later.
+        # (Judged notes stop moving, and OSU circles never move, so y says
+        # nothing about whether a slot is done.)
+        done = notes.alive[:n] & ~notes.active[:n] & (now >= target_time + 1)
+        if self.mode == "OSU":
+            for i in np.flatnonzero(done): self.index.remove(i) # Normally gone already, on hit or miss
+        notes.release(done)
+
+    def _expire(self, now):
+        # Miss detection
+        notes = self.notes
+        n = notes.high
+        live = notes.alive[:n] & notes.active[:n]
+        miss_window = 0.1 if self.mode == "OSU" else HIT_WINDOW
+        missed = live & (now > notes.target_time[:n] + miss_window)
+        missed_count = int(np.count_nonzero(missed))
+        if missed_count:
+            notes.active[:n][missed] = False
+            if self.mode == "OSU":
+                for i in np.flatnonzero(missed): self.index.remove(i)
+            self._miss(10, missed_count)
+        if self.hp <= 0: self._die()
+
+    def _die(self):
+        self.dead = True
+        self.notes.clear()
+        self.index.clear()
+
+    def drain_events(self):
+        events, self.events = self.events, []
+        return events
+
+    def result(self):
+        return {
+            "seed": self.seed,
+            "score": self.score,
+            "max_combo": self.max_combo,
+            "hp": self.hp,
+            "dead": self.dead,
+            **{k.lower(): v for k, v in self.counts.items()},
+        }
+
+def bot_player(seed=0, timing_sigma=0.03, miss_rate=0.0):
+    # Presses every note near its target time with gaussian timing error.
+    # Returns a callable (sim, t0, t1) -> events falling in [t0, t1).
+    rng = random.Random(seed)
+    planned = {}
+
+    def play(sim, t0, t1):
+        events = []
+        for x, y, lane, target_time in sim.notes.iter_active():
+            key = target_time # One note per beat, so this is unique
+            if key not in planned:
+                planned[key] = None if rng.random() < miss_rate else target_time + rng.gauss(0, timing_sigma)
+            t = planned[key]
+            if t is not None and t0 <= t < t1:
+                planned[key] = None
+                if sim.mode == "OSU": events.append(InputEvent(t, "click", None, x, y))
+                else: events.append(InputEvent(t, "press", lane, None, None))
+        events.sort(key=lambda e: e.time)
+        return events
+    return play
+
+def simulate(level_data, mode, duration=60.0, seed=None, player=None, fps=60, width=800, height=600, scroll_speed=8):
+    clock = ManualClock()
+    sim = RhythmSim(mode, level_data, width, height, scroll_speed, seed=seed, clock=clock)
+    step = 1.0 / fps
+    while clock.t < duration and not sim.dead:
+        t0 = clock.t
+        clock.advance(step)
+        if player:
+            for event in player(sim, t0, clock.t): sim.handle(event)
+        sim.update()
+        sim.drain_events()
+    return sim.result()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run headless NEURALFLOW games for balancing.")
+    parser.add_argument("--mode", default="4K", choices=["2K", "4K", "OSU"])
+    parser.add_argument("--bpm", type=int, default=120)
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--sigma", type=float, default=0.03, help="bot timing error (seconds)")
+    parser.add_argument("--miss-rate", type=float, default=0.0)
+    parser.add_argument("--fps", type=int, default=60, help="simulation steps per second")
+    args = parser.parse_args()
+
+    level = {"bpm": args.bpm, "speed": 8}
+    started = time.perf_counter()
+    results = [simulate(level, args.mode, args.duration, seed=i, player=bot_player(i, args.sigma, args.miss_rate), fps=args.fps) for i in range(args.games)]
+    elapsed = time.perf_counter() - started
+
+    survived = sum(1 for r in results if not r['dead'])
+    print(f"{args.games} games in {elapsed:.2f}s ({args.games / elapsed:.0f} games/s)")
+    print(f"survival {survived / args.games:.1%}, mean score {sum(r['score'] for r in results) / args.games:.0f}, "
+          f"mean max combo {sum(r['max_combo'] for r in results) / args.games:.1f}")
@@ -0,0 +1,38 @@
+import os
+import json
+import tempfile
+
+# Everything the game persists (level cache, charts, replays...) lives here
+DATA_DIR = os.environ.get("NEURALFLOW_HOME", os.path.join(os.path.expanduser("~"), ".neuralflow"))
+
+def data_path(*parts):
+    return os.path.join(DATA_DIR, *parts)
+
+def atomic_write_bytes(path, data):
+    # Write to a temp file in the same directory, then rename over the target,
+    # so a crash mid-write leaves either the old file or the new one.
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def atomic_write_json(path, obj):
+    atomic_write_bytes(path, json.dumps(obj, separators=(",", ":")).encode("utf-8"))
+
+def read_json(path, default=None):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default